@@ -1,30 +1,162 @@
 #!/usr/bin/env python2
 
-import collections
+import heapq
 import itertools
+import sys
+
+import numpy
 
 import cligraph
 import utils
 
 
+class CategoryStatistics(object):
+    """
+    Streaming statistics of the values for each category of a number of datasets, held in
+    dense arrays indexed by [dataset, category index]. Means and variances are merged a
+    chunk at a time using Chan et al.'s parallel algorithm, to stay numerically stable
+    """
+
+    STATISTICS = ['last', 'sum', 'mean', 'count', 'min', 'max', 'std']
+
+    def __init__(self, num_datasets):
+        self.num_datasets = num_datasets
+        self.num_categories = 0
+        self.count = self.__empty(0)
+        self.mean = self.__empty(0)
+        self.m2 = self.__empty(0)  # Sum of squared differences from the mean
+        self.min = self.__empty(0)
+        self.max = self.__empty(0)
+        self.last = self.__empty(0)
+
+    def __empty(self, capacity):
+        return numpy.zeros((self.num_datasets, capacity))
+
+    def reserve(self, num_categories):
+        """
+        Make room for at least num_categories categories, doubling capacity to keep
+        the number of copies small
+        """
+        self.num_categories = max(self.num_categories, num_categories)
+        capacity = self.count.shape[1]
+        if num_categories <= capacity:
+            return
+
+        capacity = max(num_categories, 2 * capacity)
+        for name in ['count', 'mean', 'm2', 'min', 'max', 'last']:
+            old = getattr(self, name)
+            new = self.__empty(capacity)
+            new[:, :old.shape[1]] = old
+            setattr(self, name, new)
+
+    def add(self, dataset, category_indices, values):
+        """
+        Add a chunk of values, with the category index of each
+        """
+        capacity = self.count.shape[1]
+        count = numpy.bincount(category_indices, minlength=capacity)
+        seen = count > 0
+        chunk_mean = numpy.bincount(category_indices, weights=values, minlength=capacity)
+        chunk_mean[seen] /= count[seen]
+        chunk_m2 = numpy.bincount(category_indices, minlength=capacity,
+                                  weights=(values - chunk_mean[category_indices]) ** 2)
+
+        old_count = self.count[dataset]
+        total = old_count + count
+        delta = chunk_mean - self.mean[dataset]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            self.mean[dataset][seen] += (delta * count / total)[seen]
+            self.m2[dataset][seen] += (chunk_m2 + delta ** 2 * old_count * count / total)[seen]
+
+        # Min and max start from the first value seen rather than zero
+        first_seen = seen & (old_count == 0)
+        self.min[dataset][first_seen] = numpy.inf
+        self.max[dataset][first_seen] = -numpy.inf
+        numpy.minimum.at(self.min[dataset], category_indices, values)
+        numpy.maximum.at(self.max[dataset], category_indices, values)
+
+        # The last occurrence of each category in the chunk is the first in reverse
+        reversed_indices = category_indices[::-1]
+        unique, last = numpy.unique(reversed_indices, return_index=True)
+        self.last[dataset][unique] = values[::-1][last]
+
+        self.count[dataset] = total
+
+    def get(self, statistic):
+        """
+        Return a (datasets x categories) array of the given statistic. Categories without
+        values for a dataset are zero
+        """
+        count = self.count[:, :self.num_categories]
+        if statistic == 'sum':
+            return self.mean[:, :self.num_categories] * count
+        if statistic == 'std':
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                return numpy.where(count > 0,
+                                   numpy.sqrt(self.m2[:, :self.num_categories] / count), 0)
+        return getattr(self, statistic)[:, :self.num_categories]
+
+    def get_combined(self, statistic, category_indices):
+        """
+        Return the statistic for each dataset over the values of several categories as if
+        they were one. The last values of the categories are summed
+        """
+        count = self.count[:, category_indices]
+        total = count.sum(axis=1)
+        seen = count > 0
+        if statistic == 'count':
+            return total
+        if statistic in ['sum', 'last']:
+            return self.get(statistic)[:, category_indices].sum(axis=1)
+        if statistic == 'min':
+            combined = numpy.where(seen, self.min[:, category_indices], numpy.inf).min(axis=1)
+            return numpy.where(total > 0, combined, 0)
+        if statistic == 'max':
+            combined = numpy.where(seen, self.max[:, category_indices], -numpy.inf).max(axis=1)
+            return numpy.where(total > 0, combined, 0)
+
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            mean = numpy.where(total > 0, (self.mean[:, category_indices] * count).sum(axis=1)
+                               / total, 0)
+            if statistic == 'mean':
+                return mean
+            delta = self.mean[:, category_indices] - mean[:, numpy.newaxis]
+            m2 = (self.m2[:, category_indices] + count * delta ** 2).sum(axis=1)
+            return numpy.where(total > 0, numpy.sqrt(m2 / total), 0)
+
+
 class Barchart(cligraph.CLIGraph):
 
     def __init__(self, **kwargs):
         self.categories = []
         self.category_to_index = {}
-        self.data = collections.defaultdict(lambda: collections.defaultdict(int))
-        self.errors = collections.defaultdict(lambda: collections.defaultdict(int))
         super(Barchart, self).__init__(**kwargs)
 
     def check_args(self, cli_args, inputs):
-        super(Barchart, self).check_args(cli_args, inputs)
+        if not super(Barchart, self).check_args(cli_args, inputs):
+            return False
 
-        self.fields = utils.get_columns_from_string(cli_args.field)
-        self.error_fields = utils.get_columns_from_string(cli_args.error_field)
+        self.fields = utils.get_columns_from_string(cli_args.field, self.column_names)
+        self.error_fields = utils.get_columns_from_string(cli_args.error_field, self.column_names)
+        self.cat_col = utils.get_column_from_string(cli_args.cat_field, self.column_names)
+        if self.cat_col is None:
+            return False
         if self.error_fields and len(self.fields) != len(self.error_fields):
             print >> sys.stderr, "# error columns must match # of data columns"
             return False
+        if self.error_fields and cli_args.std_errors:
+            print >> sys.stderr, "Error columns cannot be used with --std-errors"
+            return False
+        # Each bar's error is read from the same row as its value
+        if self.error_fields and cli_args.aggregate != 'last':
+            print >> sys.stderr, "Error columns can only be used with --aggregate last"
+            return False
+        if cli_args.other_label is not None and cli_args.top is None:
+            print >> sys.stderr, "--other-label requires --top"
+            return False
         self.total_datasets = len(inputs) * len(self.fields)
+        self.data = CategoryStatistics(self.total_datasets)
+        self.errors = CategoryStatistics(self.total_datasets)
         self.colours = itertools.cycle(cli_args.colours.split(','))
         self.error_colours = itertools.cycle([None] if not cli_args.e_colours else cli_args.e_colours.split(','))
         self.alphas = utils.map_csv_to_cycle(cli_args.alpha, float)
@@ -41,14 +173,34 @@ class Barchart(cligraph.CLIGraph):
         parser = super(Barchart, self).get_parser()
 
         # Inputs
-        parser.add_argument('-f', '--field', help='Column to read values from. (1-based indexing). \
-            Unix cut format for multiple columns. Default = 1', default='2')
+        parser.add_argument('-f', '--field', help='Column to read values from. (1-based indexing, \
+            or names with --header). Unix cut format for multiple columns. Default = 1',
+                            default='2')
         parser.add_argument('-e', '--error-field', help='Column to read error bars from. (1-based \
-            indexing). Unix cut format for multiple columns. Default = None', default=None)
+            indexing, or names with --header). Unix cut format for multiple columns. Only with \
+            --aggregate last. Default = None', default=None)
         parser.add_argument('-d', '--cat-field', help='Column to read category from. (1-based \
-            indexing). Default = 1', default=1, type=int)
+            indexing, or a name with --header). Default = 1', default='1')
 
         # Barchart setup
+        parser.add_argument('--aggregate', choices=CategoryStatistics.STATISTICS, default='last',
+                            help='How to combine values for rows of the same category. std is \
+                            the population standard deviation. Default = last')
+        parser.add_argument('--std-errors', action="store_true", default=False,
+                            help='Use the standard deviation of the values for each category as \
+                            error bars')
+        parser.add_argument('--top', type=int, default=None,
+                            help='Only draw the N categories with the largest total over all \
+                            datasets. Default = all')
+        parser.add_argument('--top-by', choices=['value', 'count'], default='value',
+                            help='Rank categories for --top by aggregated value or by number of \
+                            rows. Default = value')
+        parser.add_argument('--other-label', default=None,
+                            help='Fold the categories not in the top N into one bar with this \
+                            label')
+        parser.add_argument('--sort', choices=['none', 'value', 'name'], default='none',
+                            help='Order of categories. none keeps the order they first appear \
+                            in. value is largest first. Default = none')
         parser.add_argument("--logscale", help="Use a logarithmic y-axs", action="store_true",
                             default=False)
         parser.add_argument("--legends", nargs="+", help="Dataset legends", default=None)
@@ -76,31 +228,43 @@ class Barchart(cligraph.CLIGraph):
         """
         Store value for each dataset
         """
+        columns = {}
+        columns[self.cat_col] = numpy.array([fields[self.cat_col]], dtype=object)
+        for column in self.fields + self.error_fields:
+            columns[column] = numpy.array([float(fields[column])])
 
-        # Track cateogies. Any dataset missing a category will get a zero value later
-        category_index = len(self.categories)
-        category = fields[cli_args.cat_field - 1]  # -1 because argument is 1-based
-        if category in self.category_to_index:
-            category_index = self.category_to_index[category]
-        else:
-            self.category_to_index[category] = category_index
-            self.categories.append(category)
-
-        # Add data for each field
-        for index, column in enumerate(self.fields):
-            value = float(fields[column])
-            index = inp_index * len(self.fields) + index
+        self.process_input_by_columns(axes, cli_args, inp, inp_index, columns)
 
-            # Store min/max values for bin work
-            self.data[index][category_index] = value
+    def get_bulk_columns(self, cli_args):
+        return self.fields + self.error_fields, [self.cat_col]
 
-        for index, column in enumerate(self.error_fields):
-            value = float(fields[column])
-            index = inp_index * len(self.fields) + index
+    def process_input_by_columns(self, axes, cli_args, inp, inp_index, columns):
+        """
+        Add values for each dataset from a chunk of rows to the per category statistics
+        """
+        categories = columns[self.cat_col]
+
+        # Register new categories in order of first appearance
+        unique, first, inverse = numpy.unique(categories, return_index=True,
+                                              return_inverse=True)
+        for category in categories[numpy.sort(first)]:
+            if category not in self.category_to_index:
+                self.category_to_index[category] = len(self.categories)
+                self.categories.append(category)
+
+        # Map each row to its category's index
+        category_indices = numpy.array([self.category_to_index[c] for c in unique],
+                                       dtype=numpy.int64)[inverse]
+        self.data.reserve(len(self.categories))
+        self.errors.reserve(len(self.categories))
 
-            # Store min/max values for bin work
-            self.errors[index][category_index] = value
+        for index, column in enumerate(self.fields):
+            dataset = inp_index * len(self.fields) + index
+            self.data.add(dataset, category_indices, columns[column])
 
+        for index, column in enumerate(self.error_fields):
+            dataset = inp_index * len(self.fields) + index
+            self.errors.add(dataset, category_indices, columns[column])
 
     def process_input(self, axes, cli_args, inputs):
         super(Barchart, self).process_input(axes, cli_args, inputs)
@@ -126,13 +290,36 @@ class Barchart(cligraph.CLIGraph):
 
     def format_axes(self, axes, cli_args):
         super(Barchart, self).format_axes(axes, cli_args)
-        axes.set_xticks([ i + 0.5 for i in range(0, len(self.categories))])
-        axes.set_xticklabels(self.categories, fontsize=cli_args.tick_fontsize)
-        axes.set_xlim(0, len(self.categories))
+        axes.set_xticks([ i + 0.5 for i in range(0, len(self.labels))])
+        axes.set_xticklabels(self.labels, fontsize=cli_args.tick_fontsize)
+        axes.set_xlim(0, len(self.labels))
 
         if cli_args.tick_fontsize:
             map(lambda t : t.label.set_fontsize(cli_args.tick_fontsize), axes.yaxis.get_major_ticks())
 
+    def __select_categories(self, cli_args):
+        """
+        Return the indices of the categories to draw, in order, and those of the categories
+        to fold into the other bar
+        """
+        scores = self.data.get(cli_args.aggregate).sum(axis=0)
+        indices = range(len(self.categories))
+
+        if cli_args.top is not None:
+            rank = scores if cli_args.top_by == 'value' else self.data.get('count').sum(axis=0)
+            top = set(heapq.nlargest(cli_args.top, indices, key=rank.__getitem__))
+            rest = [i for i in indices if i not in top]
+            indices = [i for i in indices if i in top]
+        else:
+            rest = []
+
+        if cli_args.sort == 'value':
+            indices.sort(key=lambda i: -scores[i])
+        elif cli_args.sort == 'name':
+            indices.sort(key=lambda i: self.categories[i])
+
+        return indices, rest
+
     def __draw_barchart(self, axes, cli_args):
         """
         Plot barcharts for all dataset
@@ -140,16 +327,35 @@ class Barchart(cligraph.CLIGraph):
 
         bar_width = cli_args.width / self.total_datasets
 
+        indices, rest = self.__select_categories(cli_args)
+        self.labels = [self.categories[i] for i in indices]
+        values = self.data.get(cli_args.aggregate)[:, indices]
+        errors = None
+        if cli_args.std_errors:
+            errors = self.data.get('std')[:, indices]
+        elif self.error_fields:
+            errors = self.errors.get('last')[:, indices]
+
+        if rest and cli_args.other_label is not None:
+            self.labels.append(cli_args.other_label)
+            values = numpy.column_stack(
+                [values, self.data.get_combined(cli_args.aggregate, rest)])
+            if cli_args.std_errors:
+                errors = numpy.column_stack([errors, self.data.get_combined('std', rest)])
+            elif errors is not None:
+                # Error bars of different categories can't be combined
+                errors = numpy.column_stack([errors, numpy.zeros(self.total_datasets)])
+
         for i in range(0, self.total_datasets):
             left_pad = (1 - cli_args.width) / 2
             # X values should be adjusted for bar width
             #x_vals = [i + bar_width * x for x in range(0, len(self.categories))]
-            x_vals = [left_pad + x + i * bar_width for x in range(0, len(self.categories))]
-            y_vals = [self.data[i][self.category_to_index[c]] for c in self.categories]
+            x_vals = [left_pad + x + i * bar_width for x in range(0, len(self.labels))]
+            y_vals = values[i]
 
             y_errors = None
-            if self.error_fields:
-                y_errors = [self.errors[i][self.category_to_index[c]] for c in self.categories]
+            if errors is not None:
+                y_errors = errors[i]
 
             axes.bar(x_vals, y_vals, bar_width, facecolor=self.colours.next(), yerr=y_errors,
                      alpha=self.alphas.next(), log=cli_args.logscale, label=self.legends.next(),
@@ -158,4 +364,5 @@ class Barchart(cligraph.CLIGraph):
 
 if __name__ == '__main__':
     graph = Barchart()
-    graph.graphify()
+    if not graph.graphify():
+        sys.exit(1)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python2
+"""
+Benchmark each stage of graph creation (argument parsing, input processing,
+formatting and saving) for every graph class on synthetic input, reporting the
+time taken and the peak RSS after each stage. Results are written as JSON so
+runs can be compared:
+
+    benchmarks/stages.py --rows 1000000 -o before.json
+    benchmarks/stages.py --rows 1000000 -o after.json
+    benchmarks/stages.py --compare before.json after.json
+
+Each graph runs in a fresh process so that peak RSS is its own.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import cligraph
+import multigraph
+import utils
+
+
+class MultiHistogram(multigraph.MultiGraph):
+    """
+    A histogram of each field on its own subplot, to cover MultiGraph
+    """
+
+    def __init__(self, **kwargs):
+        super(MultiHistogram, self).__init__(2, 2, **kwargs)
+
+    def get_parser(self):
+        parser = super(MultiHistogram, self).get_parser()
+        parser.add_argument('-f', '--field', default='1-4')
+        return parser
+
+    def check_args(self, cli_args, inputs):
+        super(MultiHistogram, self).check_args(cli_args, inputs)
+        self.fields = utils.get_columns_from_string(cli_args.field, self.column_names)[:4]
+        return bool(self.fields)
+
+    def get_bulk_columns(self, cli_args):
+        return self.fields, []
+
+    def input_started_hook(self, axes, cli_args, inp, inp_index):
+        self.chunks = []
+
+    def process_input_by_columns(self, axes, cli_args, inp, inp_index, columns):
+        self.chunks.append(columns)
+
+    def input_ended_hook(self, axes, cli_args, inp, inp_index):
+        columns = utils.concatenate_columns(self.chunks, self.fields)
+        for ax, column in zip(axes, self.fields):
+            ax.hist(columns[column], 50)
+
+
+def get_graphs(num_columns):
+    """
+    Return (name, graph factory, arguments) for each graph to benchmark. The input has
+    num_columns numeric columns followed by a category column
+    """
+    last = min(num_columns, 4)
+    return [
+        ('scatter', lambda: cligraph.load_graph('scatter'), ['-x', '1', '-y', '2']),
+        ('linegraph', lambda: cligraph.load_graph('linegraph'), ['-y', '2-%d' % last]),
+        ('histogram', lambda: cligraph.load_graph('histogram'), ['-f', '1-%d' % last]),
+        ('barchart', lambda: cligraph.load_graph('barchart'),
+         ['-d', str(num_columns + 1), '-f', '1']),
+        ('multigraph', MultiHistogram, ['-f', '1-%d' % last]),
+    ]
+
+
+def generate_input(path, rows, num_columns, separator, num_categories):
+    """
+    Write random numeric columns followed by a category column
+    """
+    random.seed(0)
+    with open(path, 'w') as output:
+        for row in xrange(rows):
+            fields = ['%.6f' % random.gauss(0, 1) for _ in range(num_columns)]
+            fields.append('category%d' % (row % num_categories))
+            output.write(separator.join(fields) + '\n')
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux but bytes on OS X
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / float(scale)
+
+
+def run_stages(graph, argv):
+    """
+    Step through CLIGraph.graphify, timing each stage
+    """
+    stages = []
+
+    def stage(name, function, *args):
+        start = time.time()
+        result = function(*args)
+        stages.append({'stage': name, 'seconds': time.time() - start,
+                       'peak_rss_mb': peak_rss_mb()})
+        return result
+
+    cli_args, inputs = stage('get_args_and_inputs', graph.get_args_and_inputs,
+                             graph.get_parser(), argv)
+    if not stage('check_args', graph.check_args, cli_args, inputs):
+        raise ValueError('Invalid arguments: %s' % ' '.join(argv))
+    fig = stage('create_figure', graph.create_figure, cli_args)
+    axes = stage('create_axes', graph.create_axes, fig, cli_args)
+    stage('process_input', graph.process_input, axes, cli_args, inputs)
+    stage('format_graph', graph.format_graph, fig, axes, cli_args)
+    stage('finalise', graph.finalise, fig, cli_args)
+    return stages
+
+
+def run_one(cli_args):
+    """
+    Benchmark a single graph in this process, printing its stages as JSON
+    """
+    name, factory, graph_args = [g for g in get_graphs(cli_args.columns)
+                                 if g[0] == cli_args.run_one][0]
+    argv = [cli_args.input, '-q', '-s', os.path.join(cli_args.output_dir, name),
+            '--save-formats', cli_args.save_formats, '--separator', cli_args.separator]
+    argv += graph_args + cli_args.graph_args
+    print json.dumps(run_stages(factory(), argv))
+
+
+def compare(before_path, after_path):
+    """
+    Print the change in time and peak RSS for each graph and stage of two runs
+    """
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+
+    print '%-12s %-20s %10s %10s %8s %10s %10s' % (
+        'graph', 'stage', 'before s', 'after s', 'ratio', 'before MB', 'after MB')
+    for graph, stages in sorted(after['graphs'].items()):
+        old_stages = dict((s['stage'], s) for s in before['graphs'].get(graph, []))
+        for new in stages:
+            old = old_stages.get(new['stage'])
+            if old is None:
+                continue
+            ratio = new['seconds'] / old['seconds'] if old['seconds'] else float('nan')
+            print '%-12s %-20s %10.3f %10.3f %8.2f %10.1f %10.1f' % (
+                graph, new['stage'], old['seconds'], new['seconds'], ratio,
+                old['peak_rss_mb'], new['peak_rss_mb'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='Rows of input (default=100000)')
+    parser.add_argument('--columns', type=int, default=4,
+                        help='Numeric columns of input (default=4)')
+    parser.add_argument('--categories', type=int, default=20,
+                        help='Distinct values in the category column (default=20)')
+    parser.add_argument('--separator', default='\\t', help='Field separator (default=\\t)')
+    parser.add_argument('--save-formats', default='png', help='Formats to save (default=png)')
+    parser.add_argument('-g', '--graphs', default=None,
+                        help='Comma separated graphs to run (default=all)')
+    parser.add_argument('-o', '--output', default=None, help='Write results as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two JSON results files instead of running')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    parser.add_argument('--input', help=argparse.SUPPRESS)
+    parser.add_argument('--output-dir', help=argparse.SUPPRESS)
+    cli_args, cli_args.graph_args = parser.parse_known_args()
+    cli_args.separator = cli_args.separator.decode('string_escape')
+
+    if cli_args.compare:
+        compare(*cli_args.compare)
+        return
+    if cli_args.run_one:
+        run_one(cli_args)
+        return
+
+    names = [g[0] for g in get_graphs(cli_args.columns)]
+    if cli_args.graphs:
+        names = cli_args.graphs.split(',')
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        input_path = os.path.join(work_dir, 'input.tsv')
+        start = time.time()
+        generate_input(input_path, cli_args.rows, cli_args.columns, cli_args.separator,
+                       cli_args.categories)
+        print >> sys.stderr, 'Generated %d rows in %.1fs' % (cli_args.rows, time.time() - start)
+
+        results = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'rows': cli_args.rows,
+            'columns': cli_args.columns,
+            'categories': cli_args.categories,
+            'separator': cli_args.separator,
+            'save_formats': cli_args.save_formats,
+            'input_bytes': os.path.getsize(input_path),
+            'graphs': {},
+        }
+
+        for name in names:
+            command = [sys.executable, os.path.abspath(__file__), '--run-one', name,
+                       '--input', input_path, '--output-dir', work_dir,
+                       '--columns', str(cli_args.columns),
+                       '--separator', cli_args.separator.encode('string_escape'),
+                       '--save-formats', cli_args.save_formats] + cli_args.graph_args
+            results['graphs'][name] = json.loads(subprocess.check_output(command))
+
+            for stage in results['graphs'][name]:
+                print '%-12s %-20s %8.3fs %8.1fMB' % (name, stage['stage'], stage['seconds'],
+                                                      stage['peak_rss_mb'])
+    finally:
+        shutil.rmtree(work_dir)
+
+    if cli_args.output:
+        with open(cli_args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
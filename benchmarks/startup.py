@@ -0,0 +1,65 @@
+#!/usr/bin/env python2
+"""
+Measure the wall-clock start up cost of each graph script, for --help and for
+a trivial plot saved headless. Each command is run several times in a fresh
+interpreter and the minimum and median times are reported.
+
+    benchmarks/startup.py --repeat 10
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPTS = ['scatter.py', 'linegraph.py', 'histogram.py', 'barchart.py']
+
+
+def time_command(command, repeat):
+    """
+    Return the run times of a command, in seconds, discarding its output
+    """
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.check_call(command, stdout=devnull, stderr=devnull)
+            times.append(time.time() - start)
+    return sorted(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of runs of each command (default=5)')
+    cli_args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        data = os.path.join(work_dir, 'trivial.tsv')
+        with open(data, 'w') as data_file:
+            data_file.write('1\t2\ta\n2\t3\tb\n3\t5\tc\n')
+
+        print '%-14s %-8s %8s %8s' % ('script', 'case', 'min', 'median')
+        for script in SCRIPTS:
+            command = [sys.executable, os.path.join(ROOT, script)]
+            plot = command + [data, '-q', '-s', os.path.join(work_dir, 'plot'),
+                              '--save-formats', 'png']
+            if script == 'barchart.py':
+                plot += ['-d', '3', '-f', '2']
+
+            for case, args in [('--help', command + ['--help']), ('plot', plot)]:
+                times = time_command(args, cli_args.repeat)
+                print '%-14s %-8s %8.3f %8.3f' % (script, case, times[0], times[len(times) // 2])
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
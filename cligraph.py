@@ -1,12 +1,33 @@
 #!/usr/bin/env python2
 
 import argparse
-import matplotlib
-import matplotlib.gridspec as gridspec
+import cProfile
+import importlib
+import multiprocessing
+import os
+import shlex
 import sys
+import time
+import traceback
 
+import interactive
 import utils
 
+# Seconds to wait for input at a time with --follow, between handling window events
+FOLLOW_POLL_INTERVAL = 0.05
+
+# Formats where --rasterize applies
+VECTOR_FORMATS = set(['eps', 'pdf', 'ps', 'svg', 'svgz'])
+
+# Graphs that can be created by name, as (module, class, constructor arguments). The
+# constructor arguments match those used when running each script directly
+GRAPHS = {
+    'barchart': ('barchart', 'Barchart', {}),
+    'histogram': ('histogram', 'Histogram', {'grid_default_on': True}),
+    'linegraph': ('linegraph', 'Linegraph', {'grid_default_on': True}),
+    'scatter': ('scatter', 'Scatter', {'grid_default_on': True}),
+}
+
 
 class CLIGraph(object):
 
@@ -19,6 +40,21 @@ class CLIGraph(object):
         # Default to allow stdin, unless max_inputs has been set to 0
         self.allow_stdin = kwargs.get('allow_stdin', self.max_inputs != 0)
 
+        # If given, draw on the pyplot figure with this number, clearing it first
+        self.figure_num = kwargs.get('figure_num', None)
+
+        self.profiler = utils.Profiler()
+
+        # Redraws changing artists only, while following inputs interactively
+        self.blit = None
+
+        # Splits lines into fields for process_input_by_line. Every field is split unless
+        # process_single_input narrows it to the columns the graph reads
+        self.split_fields = utils.get_field_splitter(None)
+
+        # Column names from the first line of the inputs, with --header
+        self.column_names = None
+
         # Is there a better way to do this? Subclasses may also want this kind of
         # functionality and it could rapidly get unweidly.
         self.arg_defaults = {}
@@ -36,6 +72,9 @@ class CLIGraph(object):
         # Figure Options
         parser.add_argument("--separator", help="Field separator for tsv-like input files. \
             String.split() compatible", default=None)
+        parser.add_argument('--header', help='The first line of each input names its columns, \
+            which may then be given by name as well as number. Names are read from the first \
+            input', action='store_true', default=False)
         parser.add_argument("-t", "--title", help="Image title", default="")
         parser.add_argument("--x-label", help="Label on the x axis", default="")
         parser.add_argument("--y-label", help="Label on the y axis", default="")
@@ -63,11 +102,48 @@ class CLIGraph(object):
             format are determined by --save-formats')
         parser.add_argument('--save-formats', default='png,pdf',
                             help='A comma separated list of formats to use with --save')
+        parser.add_argument('--parallel-save', help='Save each format in its own process, at the \
+            same time', action='store_true', default=False)
+        parser.add_argument('--rasterize', help='In vector formats, rasterize data with more than \
+            --rasterize-threshold points, lines or bars', action='store_true', default=False)
+        parser.add_argument('--rasterize-threshold', help='Size of data to rasterize with \
+            --rasterize (default=10000)', type=int, default=10000)
+        parser.add_argument('--raster-dpi', help='Resolution of rasterized data in vector \
+            formats (default=300)', type=int, default=300)
         parser.add_argument("--fig-x", help="x figure size (default=8)", type=int, default=8)
         parser.add_argument("--fig-y", help="y figure size (default=6)", type=int, default=6)
         parser.add_argument("--fig-scale", help="Scale factor for figure size (default=1)",
                             type=float, default=1)
 
+        # Live Options
+        parser.add_argument('--follow', help='Redraw while inputs are still being written to, \
+            e.g. from a named pipe or tail -f. Inputs are followed one at a time. Only used by \
+            graphs reading input in bulk', action='store_true', default=False)
+        parser.add_argument('--follow-rows', help='With --follow, redraw after this many rows \
+            (default=10000)', type=int, default=10000)
+        parser.add_argument('--follow-interval', help='With --follow, redraw at least this \
+            often, in seconds (default=1)', type=float, default=1)
+        parser.add_argument('--follow-window', help='With --follow, keep only this many of the \
+            most recent rows of each input', type=int, default=None)
+
+        # Performance Options
+        parser.add_argument('-j', '--jobs', help='Number of processes to parse inputs with \
+            (default=1). Only used by graphs reading input in bulk', type=int, default=1)
+        parser.add_argument('--cache-dir', help='Directory in which to cache columns parsed from \
+            input files, to be reused while the files are unchanged. Only used by graphs reading \
+            input in bulk', default=None)
+        parser.add_argument('--infer-schema', help='Store each numeric column as int32 rather \
+            than float64 where all its values are integers that fit, and text columns with many \
+            repeats with each distinct value once, to save memory. Only used by graphs reading \
+            input in bulk', action='store_true', default=False)
+        parser.add_argument('--profile', help='Report the time taken by each stage of graph \
+            creation, and rows read per second for each input, on stderr', action='store_true',
+                            default=False)
+        parser.add_argument('--profile-output', help='Write the --profile report as JSON to this \
+            file instead')
+        parser.add_argument('--profile-cprofile', help='Write cProfile statistics for graph \
+            creation to this file, for use with pstats')
+
         return parser
 
     def add_variable_option(self, parser, name, enabled, help_text):
@@ -102,39 +178,82 @@ class CLIGraph(object):
         # Decode string separator if it exists, to handle special chars such as tab
         if cli_args.separator:
             cli_args.separator = cli_args.separator.decode('string_escape')
+        self.split_fields = utils.get_field_splitter(cli_args.separator)
 
         # Overwrite args where a parent argument exists
         if cli_args.label_fontsize:
             cli_args.x_label_fontsize = cli_args.label_fontsize
             cli_args.y_label_fontsize = cli_args.label_fontsize
 
+        if cli_args.follow_window is not None and not cli_args.follow:
+            print >> sys.stderr, '--follow-window requires --follow'
+            return False
+
+        # Read now, so that subclasses can look up named columns
+        if cli_args.header:
+            self.column_names = self.read_header(cli_args, inputs)
+
         self.num_inputs = len(inputs)
+        self.profiler.enabled = cli_args.profile or cli_args.profile_output is not None
         return True
 
-    def graphify(self):
+    def read_header(self, cli_args, inputs):
+        """
+        Read the first line of every input, returning the column names from the first
+        """
+        names = None
+        for inp in inputs:
+            line = next(inp, None)
+            if names is None and line is not None:
+                names = [name.strip() for name in line.strip().split(cli_args.separator)]
+        return names
+
+    def graphify(self, argv=None):
         """
         Step through the process of graph creation. Children not requiring large modifications
-        can simply override the appropriate methods
+        can simply override the appropriate methods. Arguments are taken from sys.argv unless
+        given. Returns whether a graph was created
         """
-        cli_args, inputs = self.get_args_and_inputs(self.get_parser())
-
-        if not self.check_args(cli_args, inputs):
-            return
-
-        fig = self.create_figure(cli_args)
-        axes = self.create_axes(fig, cli_args)
-        self.process_input(axes, cli_args, inputs)
-        self.format_graph(fig, axes, cli_args)
-        self.finalise(fig, cli_args)
+        profiler = self.profiler
+        with profiler.time('get_args_and_inputs'):
+            cli_args, inputs = self.get_args_and_inputs(self.get_parser(), argv)
+
+        with profiler.time('check_args'):
+            if not self.check_args(cli_args, inputs):
+                return False
+
+        if cli_args.profile_cprofile:
+            cprofile = cProfile.Profile()
+            cprofile.enable()
+
+        with profiler.time('create_figure'):
+            fig = self.create_figure(cli_args)
+        with profiler.time('create_axes'):
+            axes = self.create_axes(fig, cli_args)
+        with profiler.time('process_input'):
+            self.process_input(axes, cli_args, inputs)
+        with profiler.time('format_graph'):
+            self.format_graph(fig, axes, cli_args)
+        with profiler.time('finalise'):
+            self.finalise(fig, cli_args)
+
+        if cli_args.profile_cprofile:
+            cprofile.disable()
+            cprofile.dump_stats(cli_args.profile_cprofile)
+        if cli_args.profile:
+            profiler.report(sys.stderr)
+        if cli_args.profile_output:
+            profiler.save(cli_args.profile_output)
+        return True
 
-    def get_args_and_inputs(self, parser):
+    def get_args_and_inputs(self, parser, argv=None):
         """
         Return the arguments and list of inputs to read from.
         List of inputs will be length 0 or more, including stdin if allowed
         All inputs are of type utils.TransparentLineReader
         """
 
-        args, inputs = parser.parse_known_args()
+        args, inputs = parser.parse_known_args(argv)
         if self.allow_stdin and len(inputs) == 0:
             inputs = [sys.stdin]
 
@@ -177,14 +296,23 @@ class CLIGraph(object):
     def create_figure(self, cli_args):
         """
         Create the figure object, setting figure size, dpi etc.
+        matplotlib is imported here rather than at start up, which keeps --help fast
+        and lets -q choose the Agg backend before pyplot is imported.
         """
+        import matplotlib
         if cli_args.quiet:
             matplotlib.use('Agg')
         import matplotlib.pyplot as plt
 
         self.plt = plt
-        fig = plt.figure(figsize=(cli_args.fig_x * cli_args.fig_scale,
-                                  cli_args.fig_y * cli_args.fig_scale))
+        fig_size = (cli_args.fig_x * cli_args.fig_scale, cli_args.fig_y * cli_args.fig_scale)
+        fig = plt.figure(num=self.figure_num, figsize=fig_size)
+        self.figure = fig
+
+        # A reused figure keeps its previous size and contents otherwise
+        if self.figure_num is not None:
+            fig.clf()
+            fig.set_size_inches(fig_size)
 
         return fig
 
@@ -193,6 +321,7 @@ class CLIGraph(object):
         Create the axes for this graph. Although this baseclass creates
         a single subplot, grid_spec is still used for the custom tight_layout
         """
+        import matplotlib.gridspec as gridspec
 
         self.grid_spec = gridspec.GridSpec(1, 1)
         axes = [fig.add_subplot(sp) for sp in self.grid_spec]
@@ -200,6 +329,52 @@ class CLIGraph(object):
 
         return axes
 
+    def savefig(self, cli_args, format):
+        """
+        Save the figure in a single format. Rasterized artists in vector formats are
+        drawn at --raster-dpi
+        """
+        kwargs = {}
+        if cli_args.rasterize and format in VECTOR_FORMATS:
+            kwargs['dpi'] = cli_args.raster_dpi
+        self.plt.savefig(cli_args.save + '.' + format, **kwargs)
+
+    def rasterize_heavy_artists(self, fig, threshold):
+        """
+        Rasterize the data artists with more than threshold points, lines or bars, so
+        that vector output stays small; axes, labels and titles stay as vectors
+        """
+        for axes in fig.axes:
+            for collection in axes.collections:
+                if max(len(collection.get_offsets()), len(collection.get_paths())) > threshold:
+                    collection.set_rasterized(True)
+
+            for line in axes.lines:
+                if len(line.get_xdata()) > threshold:
+                    line.set_rasterized(True)
+
+            # Patches, such as histogram bars, are individual artists. Rasterizing by zorder
+            # gathers them into a single image rather than one image each
+            if len(axes.patches) > threshold:
+                axes.set_rasterization_zorder(max(p.get_zorder() for p in axes.patches) + 0.01)
+
+    def save_in_parallel(self, cli_args, formats):
+        """
+        Save each format from a forked copy of this process, so that every format is
+        drawn at the same time rather than one after another. Raises IOError if any
+        format was not saved, as saving serially would
+        """
+        processes = [multiprocessing.Process(target=self.savefig, args=(cli_args, format))
+                     for format in formats]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        failed = [f for f, process in zip(formats, processes) if process.exitcode != 0]
+        if failed:
+            raise IOError('Failed to save formats: %s' % ','.join(failed))
+
     def process_input(self, axes, cli_args, inputs):
         """
         Do something with the inputs. By default, this loops through
@@ -207,12 +382,165 @@ class CLIGraph(object):
         close the input
         """
 
+        bulk_columns = self.get_bulk_columns(cli_args)
+        if cli_args.follow and bulk_columns is not None:
+            self.process_input_following(axes, cli_args, inputs, bulk_columns)
+            return
+        if cli_args.follow:
+            print >> sys.stderr, '--follow is not supported by this graph, drawing at the end'
+        # Daemonic processes, such as pool workers, cannot start their own
+        if (cli_args.jobs > 1 and bulk_columns is not None and
+                not multiprocessing.current_process().daemon):
+            self.process_input_in_parallel(axes, cli_args, inputs, bulk_columns)
+            return
+
+        profiler = self.profiler
+        for index, inp in enumerate(inputs):
+            with profiler.time('input_started_hook'):
+                self.input_started_hook(axes, cli_args, inp, index)
+            with profiler.time('process_single_input'):
+                self.process_single_input(axes, cli_args, inp, index)
+            with profiler.time('input_ended_hook'):
+                self.input_ended_hook(axes, cli_args, inp, index)
+            inp.close()
+
+    def process_input_in_parallel(self, axes, cli_args, inputs, bulk_columns):
+        """
+        Parse inputs in a pool of worker processes, each returning the requested columns
+        of a whole input. Hooks are still called here, in input order, so drawing is
+        unchanged. Stdin cannot be handed to a worker and is parsed here instead, as are
+        inputs that were partly read for a header and can't be read again from the start
+        """
+        numeric_columns, text_columns = bulk_columns
+
+        # Cached inputs are loaded here; everything else is sent to the pool if it can be
+        caches, columns, in_worker, jobs = [], [], [], []
+        for inp in inputs:
+            cache = self.get_column_cache(cli_args, inp, bulk_columns)
+            caches.append(cache)
+            columns.append(cache.load() if cache is not None else None)
+            # Of the inputs read for a header, only memory mapped files are left unread
+            in_worker.append(columns[-1] is None and inp.handle is not sys.stdin and
+                             (not cli_args.header or inp.mmap is not None))
+            if in_worker[-1]:
+                jobs.append((inp.handle.fileno(), cli_args.separator, numeric_columns,
+                             text_columns, cli_args.header, cli_args.infer_schema))
+
+        pool = multiprocessing.Pool(min(cli_args.jobs, max(len(jobs), 1)))
+        try:
+            profiler = self.profiler
+            results = pool.imap(read_input_columns, jobs)
+            for index, inp in enumerate(inputs):
+                with profiler.time('input_started_hook'):
+                    self.input_started_hook(axes, cli_args, inp, index)
+                # Inputs parsed by workers are timed from when this process starts waiting
+                start = time.time()
+                if columns[index] is not None:
+                    with profiler.time('process_input_by_columns'):
+                        self.process_input_by_columns(axes, cli_args, inp, index, columns[index])
+                elif not in_worker[index]:
+                    # Adds its own input to the profile
+                    with profiler.time('process_single_input'):
+                        self.process_single_input(axes, cli_args, inp, index)
+                else:
+                    with profiler.time('wait_for_workers'):
+                        columns[index] = results.next()
+                    with profiler.time('process_input_by_columns'):
+                        self.process_input_by_columns(axes, cli_args, inp, index, columns[index])
+                    if caches[index] is not None:
+                        caches[index].save(columns[index])
+                if profiler.enabled and columns[index] is not None:
+                    profiler.add_input(index, utils.count_rows(columns[index]),
+                                       time.time() - start)
+                with profiler.time('input_ended_hook'):
+                    self.input_ended_hook(axes, cli_args, inp, index)
+                inp.close()
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def process_input_following(self, axes, cli_args, inputs, bulk_columns):
+        """
+        Hand each input over in chunks as it is written to, every --follow-rows rows or
+        --follow-interval seconds, and have the graph update what it has drawn after each.
+        Unless quiet, the figure is shown and its events handled while waiting. Artists
+        the graph passes to animate() are then redrawn on their own after each update
+        """
+        numeric_columns, text_columns = bulk_columns
+        profiler = self.profiler
+        if not cli_args.quiet:
+            self.blit = interactive.BlitManager(self.figure.canvas)
+            self.plt.show(block=False)
+
         for index, inp in enumerate(inputs):
-            self.input_started_hook(axes, cli_args, inp, index)
-            self.process_single_input(axes, cli_args, inp, index)
-            self.input_ended_hook(axes, cli_args, inp, index)
+            with profiler.time('input_started_hook'):
+                self.input_started_hook(axes, cli_args, inp, index)
+
+            follower = utils.LineFollower(inp, cli_args.follow_rows)
+            schema = utils.ColumnSchema() if cli_args.infer_schema else None
+            lines = []
+            rows = 0
+            start = last_update = time.time()
+            while True:
+                new_lines = follower.get_lines(FOLLOW_POLL_INTERVAL)
+                finished = new_lines is None
+                if not finished:
+                    lines.extend(new_lines)
+                    rows += len(new_lines)
+
+                # Hand over what is left at the end, but leave drawing it to the end hook
+                if lines and (finished or len(lines) >= cli_args.follow_rows or
+                              time.time() - last_update >= cli_args.follow_interval):
+                    with profiler.time('read_columns'):
+                        columns = utils.read_columns(lines, cli_args.separator,
+                                                     numeric_columns, text_columns, schema)
+                    with profiler.time('process_input_by_columns'):
+                        self.process_input_by_columns(axes, cli_args, inp, index, columns)
+                    if not finished:
+                        with profiler.time('follow_update'):
+                            self.follow_update(axes, cli_args, inp, index)
+                        if self.blit is not None:
+                            self.blit.update()
+                    last_update = time.time()
+                    lines = []
+
+                if finished:
+                    break
+                if not cli_args.quiet:
+                    self.figure.canvas.start_event_loop(0.001)
+
+            # Includes time spent waiting for the input to be written to
+            if profiler.enabled:
+                profiler.add_input(index, rows, time.time() - start)
+            with profiler.time('input_ended_hook'):
+                self.input_ended_hook(axes, cli_args, inp, index)
             inp.close()
 
+        if self.blit is not None:
+            self.blit.release()
+            self.blit = None
+
+    def animate(self, artist):
+        """
+        While following inputs interactively, redraw an artist that follow_update changes
+        on its own over a cached background, rather than redrawing the whole figure
+        """
+        if self.blit is not None:
+            self.blit.add_artist(artist)
+
+    def follow_update(self, axes, cli_args, inp, index):
+        """
+        With --follow, update what is drawn for the current input from the chunks handed to
+        process_input_by_columns so far. Graphs should change the data of artists drawn by
+        an earlier update rather than adding more, and pass new artists to animate();
+        input_ended_hook still draws the final result. By default, nothing is drawn until
+        the input ends
+        """
+        pass
+
     def input_started_hook(self, axes, cli_args, inp, index):
         pass
 
@@ -221,19 +549,115 @@ class CLIGraph(object):
 
     def process_single_input(self, axes, cli_args, inp, inp_indx):
         """
-        Process a single input(file). By default, read line by line and
-        call process input by line
+        Process a single input(file). If the graph has asked for columns in bulk,
+        read large chunks and hand over numpy arrays of just those columns.
+        Otherwise, read line by line and call process input by line
+        """
+        profiler = self.profiler
+        start = time.time()
+        rows = 0
+
+        bulk_columns = self.get_bulk_columns(cli_args)
+        if bulk_columns is not None:
+            numeric_columns, text_columns = bulk_columns
+            cache = self.get_column_cache(cli_args, inp, bulk_columns)
+            if cache is not None:
+                with profiler.time('load_cache'):
+                    columns = cache.load()
+                if columns is not None:
+                    with profiler.time('process_input_by_columns'):
+                        self.process_input_by_columns(axes, cli_args, inp, inp_indx, columns)
+                    if profiler.enabled:
+                        profiler.add_input(inp_indx, utils.count_rows(columns),
+                                           time.time() - start)
+                    return
+
+            chunks = []
+            schema = utils.ColumnSchema() if cli_args.infer_schema else None
+            with profiler.time('read_lines'):
+                lines = inp.read_lines()
+            while lines:
+                rows += len(lines)
+                with profiler.time('read_columns'):
+                    columns = utils.read_columns(lines, cli_args.separator, numeric_columns,
+                                                 text_columns, schema)
+                with profiler.time('process_input_by_columns'):
+                    self.process_input_by_columns(axes, cli_args, inp, inp_indx, columns)
+                if cache is not None:
+                    chunks.append(columns)
+                with profiler.time('read_lines'):
+                    lines = inp.read_lines()
+
+            if cache is not None:
+                with profiler.time('save_cache'):
+                    cache.save(utils.concatenate_columns(chunks, numeric_columns, text_columns))
+        else:
+            self.split_fields = utils.get_field_splitter(cli_args.separator,
+                                                         self.get_required_columns(cli_args))
+            if profiler.enabled:
+                for line in inp:
+                    rows += 1
+                    self.process_input_by_line(axes, cli_args, inp, inp_indx, line)
+            else:
+                for line in inp:
+                    self.process_input_by_line(axes, cli_args, inp, inp_indx, line)
+
+        if profiler.enabled:
+            profiler.add_input(inp_indx, rows, time.time() - start)
+
+    def get_column_cache(self, cli_args, inp, bulk_columns):
+        """
+        Return the utils.ColumnCache for an input, or None if it should not be cached
         """
-        for line in inp:
-            self.process_input_by_line(axes, cli_args, inp, inp_indx, line)
+        if cli_args.cache_dir is None or inp.filename is None:
+            return None
+
+        numeric_columns, text_columns = bulk_columns
+        return utils.ColumnCache(cli_args.cache_dir, inp.filename, cli_args.separator,
+                                 numeric_columns, text_columns, cli_args.header,
+                                 cli_args.infer_schema)
+
+    def get_bulk_columns(self, cli_args):
+        """
+        Return a tuple of (numeric columns, text columns), as 0-based indices, to
+        have inputs parsed in bulk and delivered to process_input_by_columns.
+        The default of None processes input line by line instead.
+        """
+        return None
+
+    def get_required_columns(self, cli_args):
+        """
+        Return the (0-based) columns the graph reads from each line, so that lines are
+        only split as far as the highest of them, or None to split every field. By
+        default, these are the columns asked for by get_bulk_columns()
+        """
+        bulk_columns = self.get_bulk_columns(cli_args)
+        if bulk_columns is None:
+            return None
+
+        numeric_columns, text_columns = bulk_columns
+        return list(numeric_columns) + list(text_columns)
+
+    def process_input_by_columns(self, axes, cli_args, inp, inp_indx, columns):
+        """
+        Handle a chunk of an input as a dict of column index -> numpy array. Only
+        called when get_bulk_columns() requests bulk parsing; may be called several
+        times per input.
+        """
+        pass
 
     def process_input_by_line(self, axes, cli_args, inp, inp_indx, line):
         """
         Process a line from an input(file). By default, split the line into
-        fields (based on aseparator argument), then call process_input_by_fields
+        fields (based on aseparator argument) as far as the columns from
+        get_required_columns(), then call process_input_by_fields
         """
-        fields = line.strip().split(cli_args.separator)
-        self.process_input_by_fields(axes, cli_args, inp, inp_indx, fields)
+        fields = self.split_fields(line)
+        if self.profiler.enabled:
+            with self.profiler.time('process_input_by_fields'):
+                self.process_input_by_fields(axes, cli_args, inp, inp_indx, fields)
+        else:
+            self.process_input_by_fields(axes, cli_args, inp, inp_indx, fields)
 
     def process_input_by_fields(self, axes, cli_args, inp, inp_indx, fields):
         """
@@ -259,11 +683,156 @@ class CLIGraph(object):
         """
         Set final graph attributes then show and or save
         """
-        self.grid_spec.tight_layout(
-            fig, rect=[self.gs_left, self.gs_bottom, self.gs_right, self.gs_top])
+        with self.profiler.time('tight_layout'):
+            self.grid_spec.tight_layout(
+                fig, rect=[self.gs_left, self.gs_bottom, self.gs_right, self.gs_top])
+        self.save_and_show(fig, cli_args)
+
+    def save_and_show(self, fig, cli_args):
+        """
+        Save the figure in each format requested, then show it unless quiet
+        """
         if cli_args.save is not None:
-            for format in cli_args.save_formats.split(','):
-                self.plt.savefig(cli_args.save + '.' + format)
+            formats = cli_args.save_formats.split(',')
+            if cli_args.rasterize:
+                self.rasterize_heavy_artists(fig, cli_args.rasterize_threshold)
+
+            # Daemonic processes, such as pool workers, cannot start their own
+            if (cli_args.parallel_save and len(formats) > 1 and
+                    not multiprocessing.current_process().daemon):
+                with self.profiler.time('savefig.parallel'):
+                    self.save_in_parallel(cli_args, formats)
+            else:
+                for format in formats:
+                    with self.profiler.time('savefig.' + format):
+                        self.savefig(cli_args, format)
 
         if not cli_args.quiet:
             self.plt.show()
+
+
+def read_input_columns(job):
+    """
+    Read the given columns of a whole input in a worker process. The input is
+    given as a file descriptor inherited from the parent, so named pipes and
+    process substitutions work as they would in the parent
+    """
+    fileno, separator, numeric_columns, text_columns, header, infer_schema = job
+    handle = os.fdopen(os.dup(fileno), 'r')
+    inp = utils.TransparentLineReader(handle)
+    if header:
+        next(inp, None)
+
+    chunks = []
+    schema = utils.ColumnSchema() if infer_schema else None
+    lines = inp.read_lines()
+    while lines:
+        chunks.append(utils.read_columns(lines, separator, numeric_columns, text_columns,
+                                         schema))
+        lines = inp.read_lines()
+    handle.close()
+
+    return utils.concatenate_columns(chunks, numeric_columns, text_columns)
+
+
+def load_graph(name, **kwargs):
+    """
+    Create a graph by name; either one of GRAPHS or a 'module:Class' path to a CLIGraph
+    subclass. Any kwargs are added to the constructor arguments
+    """
+    if name in GRAPHS:
+        module_name, class_name, graph_kwargs = GRAPHS[name]
+    elif ':' in name:
+        module_name, class_name = name.split(':', 1)
+        graph_kwargs = {}
+    else:
+        raise ValueError('Unknown graph: %s' % name)
+
+    graph_kwargs = dict(graph_kwargs, **kwargs)
+    graph_class = getattr(importlib.import_module(module_name), class_name)
+    return graph_class(**graph_kwargs)
+
+
+def render(name, argv, figure_num=None):
+    """
+    Create the named graph (see load_graph) from the given command line arguments.
+    Unless drawing on a reused figure, figures are closed afterwards so that long
+    running processes do not accumulate them. Returns whether a graph was created
+    """
+    graph = load_graph(name, figure_num=figure_num)
+    try:
+        return graph.graphify(argv)
+    finally:
+        if figure_num is None and hasattr(graph, 'plt'):
+            graph.plt.close('all')
+
+
+def render_batch_job(job):
+    """
+    Render one line of a batch manifest, reusing a single figure. Failures are
+    reported rather than raised, so one bad line does not stop the batch.
+    Returns (line number, error message or None)
+    """
+    line_number, name, argv = job
+    try:
+        if render(name, argv + ['--quiet'], figure_num='batch'):
+            return line_number, None
+        return line_number, 'graph not created'
+    except SystemExit as e:
+        # Argument errors exit from argparse, which has already explained why
+        return line_number, None if not e.code else 'invalid arguments'
+    except Exception:
+        return line_number, traceback.format_exc()
+
+
+def run_batch(manifest, jobs=1):
+    """
+    Render every graph listed in a manifest within this process, or a pool of jobs
+    processes. Each non-blank line not starting with # is a graph name (see load_graph)
+    followed by its arguments, quoted as for a shell. Returns whether all succeeded
+    """
+    # Graphs are always saved rather than shown
+    import matplotlib
+    matplotlib.use('Agg')
+
+    batch = []
+    with open(manifest) as manifest_file:
+        for line_number, line in enumerate(manifest_file, 1):
+            words = shlex.split(line, comments=True)
+            if words:
+                batch.append((line_number, words[0], words[1:]))
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(render_batch_job, batch)
+    else:
+        results = (render_batch_job(job) for job in batch)
+
+    failures = 0
+    for line_number, error in results:
+        if error is not None:
+            failures += 1
+            print >> sys.stderr, '%s:%d: %s' % (manifest, line_number, error.rstrip())
+
+    if jobs > 1:
+        pool.close()
+        pool.join()
+
+    return failures == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render many graphs in one process')
+    parser.add_argument('--batch', required=True, help='Manifest file listing one graph per \
+        line, as a graph name (%s) or module:Class followed by its arguments' %
+                        ', '.join(sorted(GRAPHS)))
+    parser.add_argument('-j', '--jobs', help='Number of processes to render with (default=1)',
+                        type=int, default=1)
+    cli_args = parser.parse_args()
+
+    if not run_batch(cli_args.batch, cli_args.jobs):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,14 +3,18 @@
 from __future__ import division
 import itertools
 import math
+import os
 import sys
+import tempfile
 
 import numpy
-import scipy.stats
 
 import cligraph
 import utils
 
+# Number of values to read back at a time from spilled data
+SPILL_CHUNK_SIZE = 1 << 20
+
 """
 TODO:
 - Auto-detect number of bins
@@ -21,17 +25,127 @@ TODO:
 """
 
 
+class FixedBinCounts(object):
+    """
+    Histogram counts for a fixed set of bin edges, accumulated as data arrives.
+    Values outside the edges are dropped, as numpy.histogram does
+    """
+
+    def __init__(self, edges):
+        self.edges = numpy.asarray(edges, dtype=numpy.float64)
+        self.counts = numpy.zeros(len(self.edges) - 1)
+
+    def add(self, values, weights=None):
+        self.counts += numpy.histogram(values, self.edges, weights=weights)[0]
+
+    def get_counts(self, edges):
+        return self.counts
+
+
+class GridBinCounts(object):
+    """
+    Histogram counts for bins of a fixed size, aligned so that bin edges fall on
+    origin + k * bin_size. The count array only grows to cover the range of values
+    seen, so memory does not depend on the number of values added
+    """
+
+    def __init__(self, bin_size, origin):
+        self.bin_size = bin_size
+        self.origin = origin
+        self.first = 0  # Grid index of counts[0]
+        self.counts = numpy.zeros(0)
+
+    def add(self, values, weights=None):
+        if not len(values):
+            return
+
+        grid_indices = numpy.floor((values - self.origin) / self.bin_size).astype(numpy.int64)
+        low, high = grid_indices.min(), grid_indices.max()
+
+        if not len(self.counts):
+            self.first = low
+            self.counts = numpy.zeros(high - low + 1)
+        elif low < self.first or high >= self.first + len(self.counts):
+            new_first = min(low, self.first)
+            counts = numpy.zeros(max(high, self.first + len(self.counts) - 1) - new_first + 1)
+            offset = self.first - new_first
+            counts[offset:offset + len(self.counts)] = self.counts
+            self.first, self.counts = new_first, counts
+
+        self.counts += numpy.bincount(grid_indices - self.first, weights=weights,
+                                      minlength=len(self.counts))
+
+    def get_counts(self, edges):
+        """
+        Return the counts between each pair of the given edges, which must lie on the grid
+        """
+        grid_indices = numpy.round(
+            (numpy.asarray(edges) - self.origin) / self.bin_size).astype(numpy.int64)
+        positions = numpy.clip(grid_indices - self.first, 0, len(self.counts))
+        cumulative = numpy.concatenate([[0], numpy.cumsum(self.counts)])
+        return cumulative[positions[1:]] - cumulative[positions[:-1]]
+
+
+class SpilledValues(object):
+    """
+    Values buffered in a temporary file, for when bins can only be chosen once all values
+    are known. Counting happens when the counts are asked for, so memory scales with the
+    number of bins rather than the number of values. Counts may be asked for again as more
+    values are added, until the values are closed
+    """
+
+    def __init__(self, weighted=False):
+        self.spill = tempfile.TemporaryFile()
+        self.weighted = weighted
+
+    def add(self, values, weights=None):
+        # Weights are stored alongside each value
+        if self.weighted:
+            values = numpy.column_stack([values, weights])
+        numpy.asarray(values, dtype=numpy.float64).tofile(self.spill)
+
+    def get_counts(self, edges):
+        counts = FixedBinCounts(edges)
+        width = 2 if self.weighted else 1
+
+        self.spill.seek(0)
+        values = numpy.fromfile(self.spill, numpy.float64, SPILL_CHUNK_SIZE * width)
+        while len(values):
+            if self.weighted:
+                values = values.reshape(-1, 2)
+                counts.add(values[:, 0], values[:, 1])
+            else:
+                counts.add(values)
+            values = numpy.fromfile(self.spill, numpy.float64, SPILL_CHUNK_SIZE * width)
+
+        # Later values are added after those already spilled
+        self.spill.seek(0, os.SEEK_END)
+        return counts.get_counts(edges)
+
+    def close(self):
+        self.spill.close()
+
+
 class Histogram(cligraph.CLIGraph):
 
     def __init__(self, **kwargs):
         super(Histogram, self).__init__(**kwargs)
         self.data = []
+        self.weights = []
         self.data_params = []
+        self.drawn = {}  # Dataset index -> (patches, style) of histograms drawn
 
     def check_args(self, cli_args, inputs):
-        super(Histogram, self).check_args(cli_args, inputs)
-
-        self.fields = utils.get_columns_from_string(cli_args.field)
+        if not super(Histogram, self).check_args(cli_args, inputs):
+            return False
+
+        self.fields = utils.get_columns_from_string(cli_args.field, self.column_names)
+        self.weight_field = None
+        if cli_args.weight_field is not None:
+            self.weight_field = utils.get_column_from_string(cli_args.weight_field,
+                                                             self.column_names)
+            if self.weight_field is None:
+                return False
         self.colours = itertools.cycle(cli_args.colours.split(','))
         self.markers = itertools.cycle(cli_args.markers)
 
@@ -43,7 +157,8 @@ class Histogram(cligraph.CLIGraph):
         else:
             self.legends = itertools.cycle([None])
 
-        # Should we store all data and render only after reading everything?
+        # Should we store all data (or counts, when streaming) and render only after reading
+        # everything?
         self.store = False
         if cli_args.unify_bins:
             self.store = True
@@ -52,14 +167,23 @@ class Histogram(cligraph.CLIGraph):
         if not cli_args.bins and not cli_args.bin_size:
             cli_args.bins = 10
 
+        self.stream = cli_args.stream
+        if self.stream and cli_args.follow_window is not None:
+            print >> sys.stderr, "--follow-window can't be used with --stream"
+            return False
+
         return bool(self.fields) and bool(self.alphas)
 
     def get_parser(self):
         parser = super(Histogram, self).get_parser()
 
         # Inputs
-        parser.add_argument('-f', '--field', help='Column to read values from. (1-based indexing). \
-            Unix cut format for multiple columns. Default = 1', default='1')
+        parser.add_argument('-f', '--field', help='Column to read values from. (1-based indexing, \
+            or names with --header). Unix cut format for multiple columns. Default = 1',
+                            default='1')
+        parser.add_argument('-w', '--weight-field', help='Column to read a weight or count for \
+            each row from, e.g. for pre-aggregated value/count input. (1-based indexing, or a \
+            name with --header). Default = None, where each row counts once', default=None)
 
         # Histogram setup
         parser.add_argument('--normed', help='Normalise frequency?', action="store_true",
@@ -77,6 +201,12 @@ class Histogram(cligraph.CLIGraph):
         parser.add_argument('-u', '--unify-bins', action="store_true", default=False,
                             help='Unify bin sizes across different input sources')
 
+        parser.add_argument('--stream', action="store_true", default=False,
+                            help='Count values into bins as they are read rather than storing \
+                            them, so memory does not grow with the input. Applies to --bin-size, \
+                            or to --bins with --min-x and --max-x which then also bound the bins. \
+                            Otherwise values are spilled to a temporary file until bins are known')
+
         parser.add_argument('--disable-bin-offset', help="By default, bins are offset by half their\
                             width to help bins straddle integer values for example",
                             action="store_true", default=False)
@@ -95,10 +225,13 @@ class Histogram(cligraph.CLIGraph):
         """
         if not self.store:
             self.data = []
+            self.weights = []
             self.data_params = []
+            self.drawn = {}
 
         for _ in self.fields:
-            self.data.append([])
+            self.data.append(self.__new_bin_counts(cli_args) if self.stream else [])
+            self.weights.append([])
             self.data_params.append({'min': float('inf'), 'max': float('-inf')})
 
     def input_ended_hook(self, axes, cli_args, inp, inp_index):
@@ -109,11 +242,26 @@ class Histogram(cligraph.CLIGraph):
             return
 
         self.__draw_histogram(axes, cli_args)
+        self.__close_spills()
+
+    def follow_update(self, axes, cli_args, inp, inp_index):
+        """
+        Update the heights of the bars drawn so far to the values read so far
+        """
+        # Bins shared across inputs aren't known until every input is read
+        if self.store:
+            return
+
+        self.__draw_histogram(axes, cli_args)
 
     def process_input_by_fields(self, axes, cli_args, inp, inp_index, fields):
         """
         Store value for each dataset
         """
+        weight = None
+        if self.weight_field is not None:
+            weight = float(fields[self.weight_field])
+
         for index, column in enumerate(self.fields):
             value = float(fields[column])
             if self.store:
@@ -122,7 +270,55 @@ class Histogram(cligraph.CLIGraph):
             # Store min/max values for bin work
             self.data_params[index]['min'] = min(value, self.data_params[index]['min'])
             self.data_params[index]['max'] = max(value, self.data_params[index]['max'])
-            self.data[index].append(float(fields[column]))
+            if self.stream:
+                self.data[index].add(numpy.array([value]),
+                                     None if weight is None else numpy.array([weight]))
+            else:
+                self.data[index].append(value)
+                if weight is not None:
+                    self.weights[index].append(weight)
+
+    def get_bulk_columns(self, cli_args):
+        if self.weight_field is not None:
+            return self.fields + [self.weight_field], []
+        return self.fields, []
+
+    def process_input_by_columns(self, axes, cli_args, inp, inp_index, columns):
+        """
+        Store each chunk of values for each dataset
+        """
+        weights = None
+        if self.weight_field is not None:
+            weights = columns[self.weight_field]
+
+        for index, column in enumerate(self.fields):
+            values = columns[column]
+            if not len(values):
+                continue
+            if self.store:
+                index = inp_index * len(self.fields) + index
+
+            self.data_params[index]['min'] = min(float(values.min()),
+                                                 self.data_params[index]['min'])
+            self.data_params[index]['max'] = max(float(values.max()),
+                                                 self.data_params[index]['max'])
+            if self.stream:
+                self.data[index].add(values, weights)
+            else:
+                self.data[index].append(values)
+                if weights is not None:
+                    self.weights[index].append(weights)
+                if cli_args.follow_window is not None:
+                    self.__trim_to_window(index, cli_args.follow_window)
+
+    def __trim_to_window(self, index, rows):
+        """
+        Keep only the most recent rows of a dataset, and their range for bin work
+        """
+        self.data[index] = utils.trim_arrays(self.data[index], rows)
+        self.weights[index] = utils.trim_arrays(self.weights[index], rows)
+        self.data_params[index]['min'] = min(float(values.min()) for values in self.data[index])
+        self.data_params[index]['max'] = max(float(values.max()) for values in self.data[index])
 
     def process_input(self, axes, cli_args, inputs):
         """
@@ -135,6 +331,15 @@ class Histogram(cligraph.CLIGraph):
 
         if self.store:
             self.__draw_histogram(axes, cli_args)
+            self.__close_spills()
+
+    def __close_spills(self):
+        """
+        Delete the temporary files of spilled values once they have been drawn
+        """
+        for dataset in self.data:
+            if isinstance(dataset, SpilledValues):
+                dataset.close()
 
     def apply_lables_and_titles(self, fig, axes, cli_args):
         """
@@ -148,15 +353,75 @@ class Histogram(cligraph.CLIGraph):
 
     def __draw_histogram(self, axes, cli_args):
         """
-        Plot histograms for all datasets in current data
+        Plot histograms for all datasets in current data. Datasets that have already been
+        drawn, e.g. by --follow, are updated instead
         """
 
         for index, dataset in enumerate(self.data):
             bins = self.__get_bins(cli_args, index)
-            axes.hist(dataset, bins, facecolor=self.colours.next(), alpha=self.alphas.next(),
-                      normed=cli_args.normed, cumulative=cli_args.cumulative,
-                      log=cli_args.logscale, label=self.legends.next(), hatch=self.markers.next(),
-                      histtype=self.histtypes.next())
+
+            # Streamed data is drawn from the counts, as one weighted value per bin
+            weights = None
+            if self.stream:
+                weights = dataset.get_counts(bins)
+                dataset = bins[:-1]
+            # Values read in bulk arrive as a list of arrays
+            elif dataset and isinstance(dataset[0], numpy.ndarray):
+                dataset = utils.concatenate(dataset)
+                if self.weight_field is not None:
+                    weights = utils.concatenate(self.weights[index])
+            elif self.weight_field is not None:
+                weights = self.weights[index]
+
+            if index in self.drawn:
+                self.__update_histogram(axes, cli_args, index, dataset, bins, weights)
+                continue
+
+            style = {'facecolor': self.colours.next(), 'alpha': self.alphas.next(),
+                     'label': self.legends.next(), 'hatch': self.markers.next(),
+                     'histtype': self.histtypes.next()}
+            self.drawn[index] = (self.__hist(axes, cli_args, dataset, bins, weights, style),
+                                 style)
+
+    def __hist(self, axes, cli_args, dataset, bins, weights, style):
+        """
+        Draw a histogram, returning its patches. While following inputs, these are redrawn
+        on their own
+        """
+        patches = axes.hist(dataset, bins, weights=weights, normed=cli_args.normed,
+                            cumulative=cli_args.cumulative, log=cli_args.logscale, **style)[2]
+        for patch in patches:
+            self.animate(patch)
+        return patches
+
+    def __update_histogram(self, axes, cli_args, index, dataset, bins, weights):
+        """
+        Move and resize the bars drawn for a dataset to match its current values. Other
+        histogram types, or a changed number of bins, are drawn again instead
+        """
+        patches, style = self.drawn[index]
+        heights, edges = numpy.histogram(dataset, bins, weights=weights, density=cli_args.normed)
+        if cli_args.cumulative:
+            heights = numpy.cumsum(heights * numpy.diff(edges) if cli_args.normed else heights)
+
+        if style['histtype'] == 'bar' and len(patches) == len(heights):
+            for patch, left, width, height in zip(patches, edges, numpy.diff(edges), heights):
+                patch.set_x(left)
+                patch.set_width(width)
+                patch.set_height(height)
+        else:
+            # Keep the colour of the first drawing, rather than taking the next of the cycle
+            colour = style['facecolor']
+            if style['histtype'] == 'step':
+                colour = patches[0].get_edgecolor()
+            for patch in patches:
+                patch.remove()
+            patches = self.__hist(axes, cli_args, dataset, bins, weights,
+                                  dict(style, color=colour))
+            self.drawn[index] = (patches, style)
+
+        axes.relim()
+        axes.autoscale_view()
 
     def __get_bins(self, cli_args, index):
         """
@@ -164,8 +429,12 @@ class Histogram(cligraph.CLIGraph):
         number of bins if given. Otherwise, calculate based on the supplied bin width.
         """
 
+        # Streaming with a number of bins uses fixed bins across the x axis range, if known
+        if cli_args.bins and self.stream and self.__x_range_given(cli_args):
+            return numpy.linspace(cli_args.min_x, cli_args.max_x, cli_args.bins + 1)
+
         # Short-circuit if we are given number of bins and not using equal bins
-        if cli_args.bins and not self.store:
+        if cli_args.bins and not self.store and not self.stream:
             return cli_args.bins
 
         # Get the minimum and maximum values either for this dataset or for all datasets
@@ -185,35 +454,66 @@ class Histogram(cligraph.CLIGraph):
         # Lowest bin should be the largest multiple of bin_size that is <= min_val
         # Highest bin should be smallest multiple of bin_size that is >= max_val
 
-        bins = []
-        i = math.floor(min_val / cli_args.bin_size) * cli_args.bin_size
+        # Nothing was read, so there is no range to cover. A single edge gives no bins
+        if not numpy.isfinite(min_val) or not numpy.isfinite(max_val):
+            return numpy.zeros(1)
+
+        bin_size = cli_args.bin_size
+        start = math.floor(min_val / bin_size) * bin_size
 
         # By default, bits are offset by half their width from the lowest value rather
         # than by their full width
         if not cli_args.disable_bin_offset:
-            i -= cli_args.bin_size / 2
+            start -= bin_size / 2
         else:
-            i -= cli_args.bin_size
-
-        while i <= max_val:
-            bins.append(i)
-            i += cli_args.bin_size
-        bins.append(i)  # Add final bin
+            start -= bin_size
+
+        # Every edge <= max_val, then one more for the final bin. Edges are accumulated by
+        # cumsum, which adds bin_size in the same order as a loop would, so values on the
+        # grid always fall in the same bins. Extra edges cover any rounding in the division
+        count = int(math.floor((max_val - start) / bin_size)) + 3
+        while True:
+            bins = numpy.full(count, bin_size)
+            bins[0] = start
+            bins = numpy.cumsum(bins)
+            if bins[-1] > max_val:
+                break
+            count *= 2
+        bins = bins[:numpy.searchsorted(bins, max_val, side='right') + 1]
 
         # Combine offscreen bins for faster renders
         if cli_args.min_x and cli_args.min_x > min_val:
-            first_onscreen = max([index for index, b in enumerate(bins) if b <= cli_args.min_x])
+            # Last edge <= min_x
+            first_onscreen = numpy.searchsorted(bins, cli_args.min_x, side='right') - 1
             # Include the first bin so that this captures everything offscren
             if first_onscreen >= 2:
-                bins = [bins[0]] + bins[first_onscreen:]
+                bins = numpy.concatenate([bins[:1], bins[first_onscreen:]])
         if cli_args.max_x and cli_args.max_x < max_val:
-            last_onscreen = min([index for index, b in enumerate(bins) if b > cli_args.max_x])
+            # First edge > max_x
+            last_onscreen = numpy.searchsorted(bins, cli_args.max_x, side='right')
             if last_onscreen < len(bins) - 1:
-                bins = bins[:last_onscreen] + [bins[-1]]
+                bins = numpy.concatenate([bins[:last_onscreen], bins[-1:]])
 
         return bins
 
+    def __new_bin_counts(self, cli_args):
+        """
+        Create the bin counts for streaming a dataset, with bins matching __get_bins
+        """
+        if cli_args.bins and self.__x_range_given(cli_args):
+            return FixedBinCounts(self.__get_bins(cli_args, None))
+        if cli_args.bins:
+            return SpilledValues(weighted=self.weight_field is not None)
+
+        if cli_args.disable_bin_offset:
+            return GridBinCounts(cli_args.bin_size, 0)
+        return GridBinCounts(cli_args.bin_size, -cli_args.bin_size / 2)
+
+    def __x_range_given(self, cli_args):
+        return cli_args.min_x is not None and cli_args.max_x is not None
+
 
 if __name__ == '__main__':
     hist = Histogram(grid_default_on=True)
-    hist.graphify()
+    if not hist.graphify():
+        sys.exit(1)
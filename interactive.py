@@ -0,0 +1,133 @@
+"""
+Helpers for keeping interactive figures fast with large data: redrawing only the
+artists that change over a cached background, and finding the point nearest a
+click, or the points in a box, without testing every point
+"""
+
+import numpy
+
+# Nearest points, by normalised data distance, checked in display space for a click
+PICK_CANDIDATES = 8
+
+
+class BlitManager:
+    """
+    Redraw a set of animated artists over a cached copy of the rest of the figure
+    (axes, grid, labels and any data that isn't changing). The background is captured
+    whenever the figure is fully drawn, and the figure is fully drawn again when the
+    limits of any axes change, as the ticks and grid then change too
+    """
+    def __init__(self, canvas, artists=()):
+        self.canvas = canvas
+        self.artists = []
+        self.background = None
+        self.background_key = None
+        self.connection = canvas.mpl_connect('draw_event', self.__on_draw)
+        for artist in artists:
+            self.add_artist(artist)
+
+    def add_artist(self, artist):
+        artist.set_animated(True)
+        self.artists.append(artist)
+
+    def __key(self):
+        """
+        Everything that invalidates the cached background when changed
+        """
+        figure = self.canvas.figure
+        return (tuple(figure.bbox.bounds),
+                tuple(tuple(axes.viewLim.bounds) for axes in figure.axes))
+
+    def __on_draw(self, event):
+        # Animated artists are left out of full draws, so the background is what remains
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self.background_key = self.__key()
+        self.__draw_artists()
+
+    def __draw_artists(self):
+        # Artists removed from their axes are forgotten
+        self.artists = [artist for artist in self.artists if artist.axes is not None]
+        for artist in self.artists:
+            self.canvas.figure.draw_artist(artist)
+
+    def update(self):
+        """
+        Show the current state of the animated artists
+        """
+        if not self.canvas.supports_blit:
+            self.canvas.draw_idle()
+            return
+
+        if self.background is None or self.__key() != self.background_key:
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self.__draw_artists()
+        self.canvas.blit(self.canvas.figure.bbox)
+        self.canvas.flush_events()
+
+    def release(self):
+        """
+        Stop managing the artists, so that they are drawn (and saved) as normal again
+        """
+        self.canvas.mpl_disconnect(self.connection)
+        for artist in self.artists:
+            artist.set_animated(False)
+        self.artists = []
+
+
+class PointIndex:
+    """
+    A KD-tree over points, for finding the point nearest a click, or those in a box, in
+    logarithmic rather than linear time. Points are normalised by the range of each axis,
+    so that distance is roughly as it looks; the nearest few are then compared in display
+    coordinates
+    """
+    def __init__(self, x_data, y_data):
+        # scipy is slow to import and only needed for interactive use
+        import scipy.spatial
+
+        self.points = numpy.column_stack([numpy.asarray(x_data, dtype=numpy.float64),
+                                          numpy.asarray(y_data, dtype=numpy.float64)])
+        self.offset = self.points.min(axis=0) if len(self.points) else numpy.zeros(2)
+        scale = self.points.max(axis=0) - self.offset if len(self.points) else numpy.ones(2)
+        self.scale = numpy.where(scale > 0, scale, 1)
+        self.tree = scipy.spatial.cKDTree((self.points - self.offset) / self.scale)
+
+    def nearest(self, axes, x_pixel, y_pixel, max_pixels):
+        """
+        Return (index, distance in pixels) of the point nearest the given display coordinates
+        in axes, or None if there is no point within max_pixels of them
+        """
+        if not len(self.points):
+            return None
+
+        x, y = axes.transData.inverted().transform((x_pixel, y_pixel))
+        query = (numpy.array([x, y]) - self.offset) / self.scale
+        candidates = numpy.atleast_1d(
+            self.tree.query(query, min(PICK_CANDIDATES, len(self.points)))[1])
+
+        pixels = axes.transData.transform(self.points[candidates])
+        distances = numpy.hypot(pixels[:, 0] - x_pixel, pixels[:, 1] - y_pixel)
+        closest = distances.argmin()
+        if distances[closest] > max_pixels:
+            return None
+        return int(candidates[closest]), distances[closest]
+
+    def within(self, x_min, x_max, y_min, y_max):
+        """
+        Return the indices, in order, of the points inside a box in data coordinates
+        """
+        if not len(self.points):
+            return numpy.arange(0)
+
+        # Gather the points in a square around the box, then keep those inside it
+        low = (numpy.array([x_min, y_min]) - self.offset) / self.scale
+        high = (numpy.array([x_max, y_max]) - self.offset) / self.scale
+        candidates = numpy.array(self.tree.query_ball_point(
+            (low + high) / 2, (high - low).max() / 2, p=numpy.inf), dtype=numpy.int64)
+
+        points = self.points[candidates]
+        inside = ((points[:, 0] >= x_min) & (points[:, 0] <= x_max) &
+                  (points[:, 1] >= y_min) & (points[:, 1] <= y_max))
+        return numpy.sort(candidates[inside])
@@ -1,9 +1,10 @@
 #!/usr/bin/env python2
 
+from __future__ import division
 import itertools
 import sys
 
-import scipy.stats
+import numpy
 
 import cligraph
 import utils
@@ -16,24 +17,30 @@ class Linegraph(cligraph.CLIGraph):
         self.axes_twin = None
 
     def check_args(self, cli_args, inputs):
-        super(Linegraph, self).check_args(cli_args, inputs)
+        if not super(Linegraph, self).check_args(cli_args, inputs):
+            return False
 
-        self.x_col = cli_args.x_column - 1
-        self.y_cols = utils.get_columns_from_string(cli_args.y_column)
+        self.x_col = utils.get_column_from_string(cli_args.x_column, self.column_names)
+        self.y_cols = utils.get_columns_from_string(cli_args.y_column, self.column_names)
 
         self.colours = itertools.cycle(cli_args.colours)
         self.axes_associations = utils.map_csv_to_cycle(cli_args.axes, int)
 
-        return bool(self.y_cols) and self.axes_associations
+        return self.x_col is not None and bool(self.y_cols) and self.axes_associations
 
     def get_parser(self):
         parser = super(Linegraph, self).get_parser()
 
         # Inputs
-        parser.add_argument("-x", "--x-column", help="Column for x values. (1-based indexing). \
-            Default = 1", type=int, default=1)
-        parser.add_argument("-y", "--y-column", help="Column for y values. (1-based indexing). \
-            Unix cut format for multiple columns. Default = 2", default="2")
+        parser.add_argument("-x", "--x-column", help="Column for x values. (1-based indexing, \
+            or a name with --header). Default = 1", default="1")
+        parser.add_argument("-y", "--y-column", help="Column for y values. (1-based indexing, \
+            or names with --header). Unix cut format for multiple columns. Default = 2",
+                            default="2")
+
+        parser.add_argument('--downsample', action="store_true", default=False,
+                            help="Reduce each line to its minimum and maximum within each pixel \
+                            width of the figure before drawing")
 
         parser.add_argument('-c', '--colours', default='rgbcymk')
         parser.add_argument('-a', '--axes', help="Comma separated 1 and 2, to associate inputs \
@@ -45,17 +52,92 @@ class Linegraph(cligraph.CLIGraph):
         self.y_data = []
         for _ in self.y_cols:
             self.y_data.append([])
+        self.chunks = []
+        self.follow_lines = None
+
+        # Chosen now so that lines drawn by --follow look the same as the final ones
+        self.styles = [(self.colours.next(), self.axes_associations.next())
+                       for _ in self.y_cols]
+
+    def follow_update(self, axes, cli_args, inp, inp_index):
+        """
+        Change the data of the lines drawn so far to that read so far, rather than drawing
+        new lines
+        """
+        x_data = utils.concatenate([chunk[self.x_col] for chunk in self.chunks])
+        num_buckets = int(cli_args.fig_x * cli_args.fig_scale * axes.figure.dpi)
+
+        if self.follow_lines is None:
+            self.follow_lines = [self.__get_axes(axes, association).plot([], [], c=colour)[0]
+                                 for colour, association in self.styles]
+            for line in self.follow_lines:
+                self.animate(line)
+
+        for line, column in zip(self.follow_lines, self.y_cols):
+            data = utils.concatenate([chunk[column] for chunk in self.chunks])
+            if cli_args.downsample:
+                line.set_data(*self.downsample(x_data, data, num_buckets))
+            else:
+                line.set_data(x_data, data)
+            line.axes.relim()
+            line.axes.autoscale_view()
 
     def input_ended_hook(self, axes, cli_args, inp, inp_index):
+        if self.follow_lines is not None:
+            for line in self.follow_lines:
+                line.remove()
+        if self.chunks:
+            self.x_data = utils.concatenate([chunk[self.x_col] for chunk in self.chunks])
+            self.y_data = [utils.concatenate([chunk[column] for chunk in self.chunks])
+                           for column in self.y_cols]
+            self.chunks = []
+
+        # Each pixel column of the figure gets its own bucket when downsampling
+        num_buckets = int(cli_args.fig_x * cli_args.fig_scale * axes.figure.dpi)
+
+        for data, (colour, association) in zip(self.y_data, self.styles):
+            x_data = self.x_data
+            if cli_args.downsample:
+                x_data, data = self.downsample(numpy.asarray(x_data), numpy.asarray(data),
+                                               num_buckets)
+
+            self.__get_axes(axes, association).errorbar(x_data, data, c=colour)
+
+    def __get_axes(self, axes, association):
+        """
+        Return the axes for inputs associated with y-axis 1 or 2, creating the twin if needed
+        """
+        if association != 2:
+            return axes
+        if self.axes_twin is None:
+            self.axes_twin = axes.twinx()
+        return self.axes_twin
 
-        for data in self.y_data:
-            axis_to_use = axes
-            association = self.axes_associations.next()
-            if association == 2:
-                if self.axes_twin is None:
-                    self.axes_twin = axes.twinx()
-                axis_to_use = self.axes_twin
-            axis_to_use.errorbar(self.x_data, data, c=self.colours.next())
+    def downsample(self, x_data, y_data, num_buckets):
+        """
+        Reduce a series to the minimum and maximum points within each of num_buckets equal
+        ranges of x, keeping their original order so that peaks and troughs still show
+        """
+        if len(x_data) <= 2 * num_buckets:
+            return x_data, y_data
+
+        # As floats, so that integer columns can't overflow
+        min_x, max_x = float(x_data.min()), float(x_data.max())
+        if max_x == min_x:
+            buckets = numpy.zeros(len(x_data), dtype=numpy.int64)
+        else:
+            buckets = numpy.floor((x_data - min_x) / float(max_x - min_x) * num_buckets)
+            buckets = numpy.minimum(buckets, num_buckets - 1).astype(numpy.int64)
+
+        # Sort by bucket, then y; the first and last of each bucket are its min and max
+        order = numpy.lexsort((y_data, buckets))
+        boundaries = numpy.flatnonzero(numpy.diff(buckets[order]))
+        firsts = order[numpy.concatenate([[0], boundaries + 1])]
+        lasts = order[numpy.concatenate([boundaries, [len(order) - 1]])]
+
+        # Always keep the end points so the line spans the full range
+        kept = numpy.unique(numpy.concatenate([firsts, lasts, [0, len(x_data) - 1]]))
+        return x_data[kept], y_data[kept]
 
     def process_input_by_fields(self, axes, cli_args, inp, inp_index, fields):
         """
@@ -65,6 +147,18 @@ class Linegraph(cligraph.CLIGraph):
         for index, column in enumerate(self.y_cols):
             self.y_data[index].append(float(fields[column]))
 
+    def get_bulk_columns(self, cli_args):
+        return [self.x_col] + self.y_cols, []
+
+    def process_input_by_columns(self, axes, cli_args, inp, inp_index, columns):
+        """
+        Keep each chunk of columns; they are joined together once the input ends
+        """
+        self.chunks.append(columns)
+        if cli_args.follow_window is not None:
+            self.chunks = utils.trim_chunks(self.chunks, cli_args.follow_window)
+
 if __name__ == '__main__':
     l = Linegraph(grid_default_on=True)
-    l.graphify()
\ No newline at end of file
+    if not l.graphify():
+        sys.exit(1)
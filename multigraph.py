@@ -3,9 +3,6 @@ An extension of a standard cligraph for plotting
 graphs with subplots using gridspec
 """
 
-import matplotlib
-import matplotlib.gridspec as gridspec
-
 from cligraph import CLIGraph
 
 
@@ -66,6 +63,7 @@ class MultiGraph(CLIGraph):
         """
         Create the axes for this graph using gridspec for subplots
         """
+        import matplotlib.gridspec as gridspec
 
         self.grid_spec = gridspec.GridSpec(self.num_plots_x, self.num_plots_y)
         axes = [fig.add_subplot(sp) for sp in self.grid_spec]
@@ -100,12 +98,8 @@ class MultiGraph(CLIGraph):
         """
         Set final graph attributes then show and or save
         """
-        self.grid_spec.tight_layout(
-            fig, h_pad=cli_args.h_pad, w_pad=cli_args.w_pad,
-            rect=[self.gs_left, self.gs_bottom, self.gs_right, self.gs_top])
-        if cli_args.save is not None:
-            for format in cli_args.save_formats.split(','):
-                self.plt.savefig(cli_args.save + '.' + format)
-
-        if not cli_args.quiet:
-            self.plt.show()
+        with self.profiler.time('tight_layout'):
+            self.grid_spec.tight_layout(
+                fig, h_pad=cli_args.h_pad, w_pad=cli_args.w_pad,
+                rect=[self.gs_left, self.gs_bottom, self.gs_right, self.gs_top])
+        self.save_and_show(fig, cli_args)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python2
+"""
+A persistent render server, to avoid paying for matplotlib, numpy and scipy imports
+on every graph when producing many of them. The server keeps a pool of warm worker
+processes; a thin client sends it the graph name and arguments over a Unix socket.
+
+    render_server.py serve --workers 4 &
+    render_server.py send scatter examples/iris.tsv -s iris --save-formats png
+
+Graphs are always rendered quietly (-q), so --save is required. Inputs must be paths
+the server can open; relative paths are resolved against the client's directory.
+Stdin and process substitutions of the client are not available to the server.
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import SocketServer
+import StringIO
+import sys
+import tempfile
+import traceback
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'cligraph-%d.sock' % os.getuid())
+
+
+def warm_up():
+    """
+    Import everything a graph may need, choosing the Agg backend before pyplot
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    import scipy.stats
+
+    import cligraph
+    for module_name, _, _ in cligraph.GRAPHS.values():
+        __import__(module_name)
+
+
+def render_job(request):
+    """
+    Render a single request in a worker, returning its success and anything written to
+    stdout or stderr so the client can show them
+    """
+    import cligraph
+
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+    ok = False
+    try:
+        os.chdir(request['cwd'])
+        ok = cligraph.render(request['graph'], request['argv'] + ['--quiet'])
+    except SystemExit as e:
+        # Argument errors exit from argparse
+        ok = not e.code
+    except Exception:
+        traceback.print_exc()
+        ok = False
+    finally:
+        response = {'ok': bool(ok), 'stdout': sys.stdout.getvalue(),
+                    'stderr': sys.stderr.getvalue()}
+        sys.stdout, sys.stderr = stdout, stderr
+
+    return response
+
+
+class RenderHandler(SocketServer.StreamRequestHandler):
+    """
+    Read one JSON request line and reply with one JSON response line
+    """
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            response = self.server.pool.apply(render_job, (request,))
+        except Exception:
+            response = {'ok': False, 'stdout': '', 'stderr': traceback.format_exc()}
+        self.wfile.write(json.dumps(response) + '\n')
+
+
+class RenderServer(SocketServer.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, pool):
+        self.pool = pool
+        SocketServer.ThreadingUnixStreamServer.__init__(self, socket_path, RenderHandler)
+
+
+def serve(cli_args):
+    import multiprocessing
+
+    if os.path.exists(cli_args.socket):
+        os.unlink(cli_args.socket)
+
+    pool = multiprocessing.Pool(cli_args.workers, warm_up)
+    server = RenderServer(cli_args.socket, pool)
+
+    # Clean up the socket when killed, as well as on interrupt
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(cli_args.socket)
+        pool.terminate()
+        pool.join()
+
+
+def send(cli_args):
+    request = {'graph': cli_args.graph, 'argv': cli_args.args, 'cwd': os.getcwd()}
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(cli_args.socket)
+    client.sendall(json.dumps(request) + '\n')
+    response = json.loads(client.makefile().readline())
+    client.close()
+
+    sys.stdout.write(response['stdout'])
+    sys.stderr.write(response['stderr'])
+    return response['ok']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render graphs from a persistent server')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help='Path of the Unix socket. Default = %s' % DEFAULT_SOCKET)
+    subparsers = parser.add_subparsers()
+
+    serve_parser = subparsers.add_parser('serve', help='Run the server')
+    serve_parser.add_argument('-w', '--workers', type=int, default=None,
+                              help='Number of worker processes. Default = number of CPUs')
+    serve_parser.set_defaults(action=serve)
+
+    send_parser = subparsers.add_parser('send', help='Ask the server to render a graph')
+    send_parser.add_argument('graph', help='Graph name (e.g. scatter) or module:Class')
+    send_parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments for the graph')
+    send_parser.set_defaults(action=send)
+
+    cli_args = parser.parse_args()
+    if cli_args.action(cli_args) is False:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
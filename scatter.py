@@ -1,39 +1,86 @@
 #!/usr/bin/env python2
 
+from __future__ import division
 import itertools
+import math
 import sys
 
-import scipy.stats
+import numpy
 
 import cligraph
+import interactive
 import utils
 
+# Pixels beyond the edge of a point that a click on it may be
+PICK_TOLERANCE = 5
+
+# Onclick data printed for points selected with a box; the rest are counted
+MAX_SELECTED_PRINTED = 20
+
 
 class Scatter(cligraph.CLIGraph):
 
     def __init__(self, **kwargs):
         super(Scatter, self).__init__(**kwargs)
-        self.onclick_data = []
+        # (dataset name, interactive.PointIndex, onclick data, pick radius) for each input
+        self.pickable = []
+
+    def onclick(self, axes, event):
+        """
+        Print the onclick data of the point clicked on, found through a spatial index of
+        each dataset rather than by testing every point, and mark it
+        """
+        if event.inaxes is not axes or event.button != 1:
+            return
+
+        hits = []
+        for dataset in self.pickable:
+            hit = dataset[1].nearest(axes, event.x, event.y, dataset[3])
+            if hit is not None:
+                hits.append((hit[1], hit[0], dataset))
+        if not hits:
+            return
+
+        _, index, (name, point_index, onclick_data, _) = min(hits)
+        if self.num_inputs > 1:
+            print "Dataset:", name
+        print [index]
+        print "Data:", onclick_data[index]
+        x, y = point_index.points[index]
+        self.highlight.set_data([x], [y])
+        self.highlight_blit.update()
+
+    def onselect(self, press, release):
+        """
+        Print the onclick data of the points inside a box dragged out with the right button
+        """
+        x_min, x_max = sorted([press.xdata, release.xdata])
+        y_min, y_max = sorted([press.ydata, release.ydata])
 
-    def onclick(self, event):
-        print event.ind
-        data = self.onclick_data[event.ind[0]]
-        print "Data:", data
+        for name, point_index, onclick_data, _ in self.pickable:
+            indices = point_index.within(x_min, x_max, y_min, y_max)
+            if self.num_inputs > 1:
+                print "Dataset:", name
+            print "Points:", len(indices)
+            for index in indices[:MAX_SELECTED_PRINTED]:
+                print "Data:", onclick_data[index]
+            if len(indices) > MAX_SELECTED_PRINTED:
+                print "..."
 
     def check_args(self, cli_args, inputs):
-        super(Scatter, self).check_args(cli_args, inputs)
+        if not super(Scatter, self).check_args(cli_args, inputs):
+            return False
         self.colours = itertools.cycle(cli_args.colours)
         self.markers = itertools.cycle(cli_args.markers)
 
-        self.x_col = cli_args.x_column - 1
-        self.y_col = cli_args.y_column - 1
-        self.annotate_col = None if not cli_args.annotate_column else cli_args.annotate_column - 1
-        self.onclick_col = None
-        if cli_args.onclick_column:
-            if len(inputs) > 1:
-                print >> sys.stderr, "Onclick is currently only supported for single datasets."
-                return False
-            cli_args.onclick_column - 1
+        self.x_col = utils.get_column_from_string(cli_args.x_column, self.column_names)
+        self.y_col = utils.get_column_from_string(cli_args.y_column, self.column_names)
+        if self.x_col is None or self.y_col is None:
+            return False
+        self.annotate_col = utils.get_column_from_string(cli_args.annotate_column,
+                                                         self.column_names)
+        self.onclick_col = utils.get_column_from_string(cli_args.onclick_column,
+                                                        self.column_names)
 
         # If we don't legend labels, make it a cycle of 'None'
         if not cli_args.legend:
@@ -49,14 +96,14 @@ class Scatter(cligraph.CLIGraph):
         parser = super(Scatter, self).get_parser()
 
         # Inputs
-        parser.add_argument("-x", "--x-column", help="Column for x values. (1-based indexing). \
-            Default = 1", type=int, default=1)
-        parser.add_argument("-y", "--y-column", help="Column for y values. (1-based indexing). \
-            Default = 2", type=int, default=2)
-        parser.add_argument("--annotate-column", help="Column for annotations. (1-based indexing)",
-                            type=int, default=None)
-        parser.add_argument("--onclick-column", help="Column for onclick data. (1-based indexing)",
-                            type=int, default=None)
+        parser.add_argument("-x", "--x-column", help="Column for x values. (1-based indexing, \
+            or a name with --header). Default = 1", default='1')
+        parser.add_argument("-y", "--y-column", help="Column for y values. (1-based indexing, \
+            or a name with --header). Default = 2", default='2')
+        parser.add_argument("--annotate-column", help="Column for annotations. (1-based indexing, \
+            or a name with --header)", default=None)
+        parser.add_argument("--onclick-column", help="Column for onclick data. (1-based \
+            indexing, or a name with --header)", default=None)
 
         # Figure display options
         # Maybe some of these things could be handled generically; though
@@ -67,6 +114,16 @@ class Scatter(cligraph.CLIGraph):
         parser.add_argument('-a', '--alpha', default='1')
         parser.add_argument('-l', '--legend', default=None)
 
+        # Large datasets
+        parser.add_argument('--thin', action="store_true", default=False,
+                            help='Draw at most one point per pixel of the figure. Annotations and \
+                            onclick data follow the points that are drawn')
+        parser.add_argument('--density-threshold', type=int, default=None,
+                            help='Draw a hexbin density plot instead of points for datasets with \
+                            more than this many points (after any thinning)')
+        parser.add_argument('--density-gridsize', type=int, default=100,
+                            help='Number of hexagons across the x axis for density plots')
+
         parser.add_argument('--stats', action="store_true", default=False)
         parser.add_argument('--stats-title', action="store_true", default=False)
         return parser
@@ -75,12 +132,83 @@ class Scatter(cligraph.CLIGraph):
         self.x_data = []
         self.y_data = []
         self.annotate_data = []
+        self.onclick_data = []
+        self.chunks = []
+        self.follow_points = None
+
+        # Chosen now so that points drawn by --follow look the same as the final ones
+        self.style = (self.colours.next(), self.markers.next(), self.point_sizes.next(),
+                      self.alphas.next(), self.legends.next())
+
+    def follow_update(self, axes, cli_args, inp, inp_index):
+        """
+        Move the points drawn so far to those read so far, rather than drawing new ones
+        """
+        x_data = utils.concatenate([chunk[self.x_col] for chunk in self.chunks])
+        y_data = utils.concatenate([chunk[self.y_col] for chunk in self.chunks])
+        if cli_args.thin:
+            kept = self.thin_points(axes, cli_args, x_data, y_data)
+            x_data, y_data = x_data[kept], y_data[kept]
+        offsets = numpy.column_stack([x_data, y_data])
+
+        if self.follow_points is None:
+            # The final points set the limits, so these are put back at the end. The view
+            # matters too, as the data limits include the size of the points
+            self.follow_limits = (axes.dataLim.frozen(), axes.ignore_existing_data_limits,
+                                  axes.get_xlim(), axes.get_ylim())
+            colour, marker, point_size, alpha, _ = self.style
+            self.follow_points = axes.scatter(x_data, y_data, c=colour, marker=marker,
+                                              s=point_size, alpha=alpha)
+            self.animate(self.follow_points)
+        else:
+            self.follow_points.set_offsets(offsets)
+
+        # Collections aren't included by relim, so extend the data limits directly
+        axes.update_datalim(offsets)
+        axes.autoscale_view()
 
     def input_ended_hook(self, axes, cli_args, inp, inp_index):
-        scatter = axes.scatter(
-            self.x_data, self.y_data, c=self.colours.next(), marker=self.markers.next(),
-            s=self.point_sizes.next(), alpha=self.alphas.next(), label=self.legends.next(),
-            picker=True)
+        if self.follow_points is not None:
+            self.follow_points.remove()
+            data_limits, axes.ignore_existing_data_limits, x_limits, y_limits = self.follow_limits
+            axes.dataLim.set(data_limits)
+            axes.set_xlim(x_limits, auto=None)
+            axes.set_ylim(y_limits, auto=None)
+        if self.chunks:
+            self.gather_chunks()
+
+        # Statistics are always calculated on the full dataset, before any thinning
+        x_data, y_data = numpy.asarray(self.x_data), numpy.asarray(self.y_data)
+        annotate_data = self.annotate_data
+        # Onclick data is kept as fixed width strings, rather than a Python object per point
+        onclick_data = numpy.array(self.onclick_data, dtype=str)
+        if cli_args.thin:
+            kept = self.thin_points(axes, cli_args, x_data, y_data)
+            x_data, y_data = x_data[kept], y_data[kept]
+            if self.annotate_col is not None:
+                annotate_data = [annotate_data[i] for i in kept]
+            if self.onclick_col is not None:
+                onclick_data = onclick_data[kept]
+
+        colour, marker, point_size, alpha, label = self.style
+
+        if cli_args.density_threshold is not None and len(x_data) > cli_args.density_threshold:
+            # Too many points to draw individually; show their density instead
+            import matplotlib.colors
+            cmap = matplotlib.colors.LinearSegmentedColormap.from_list('density', ['w', colour])
+            scatter = axes.hexbin(x_data, y_data, gridsize=cli_args.density_gridsize, mincnt=1,
+                                  cmap=cmap, alpha=alpha, label=label)
+            annotate_data = []
+        else:
+            scatter = axes.scatter(x_data, y_data, c=colour, marker=marker, s=point_size,
+                                   alpha=alpha, label=label)
+
+        if self.onclick_col is not None:
+            # Point sizes are areas in points squared
+            pick_radius = math.sqrt(point_size) / 2 * axes.figure.dpi / 72 + PICK_TOLERANCE
+            self.pickable.append((label or str(inp_index),
+                                  interactive.PointIndex(x_data, y_data), onclick_data,
+                                  pick_radius))
 
         if cli_args.stats or cli_args.stats_title:
             stats_id = scatter.get_label()
@@ -88,11 +216,41 @@ class Scatter(cligraph.CLIGraph):
                 stats_id = str(inp_index)
             self.calc_and_show_stats(cli_args, stats_id)
 
-        if self.annotate_col:
-            for i, annotation in enumerate(self.annotate_data):
-                axes.annotate(annotation, (self.x_data[i], self.y_data[i]))
+        if self.annotate_col is not None:
+            for i, annotation in enumerate(annotate_data):
+                axes.annotate(annotation, (x_data[i], y_data[i]))
+
+    def thin_points(self, axes, cli_args, x_data, y_data):
+        """
+        Return the indices of the points to draw such that at most one point is drawn per
+        pixel of the figure. The first point in each pixel is kept, preserving input order
+        """
+        if not len(x_data):
+            return numpy.arange(0)
+
+        width, height = axes.figure.get_size_inches() * axes.figure.dpi
+        x_pixels = self.__pixel_indices(x_data, cli_args.min_x, cli_args.max_x, int(width))
+        y_pixels = self.__pixel_indices(y_data, cli_args.min_y, cli_args.max_y, int(height))
+
+        pixels = x_pixels * (int(height) + 2) + y_pixels
+        return numpy.sort(numpy.unique(pixels, return_index=True)[1])
+
+    def __pixel_indices(self, values, min_val, max_val, num_pixels):
+        """
+        Map values onto pixel indices across the axis range. Offscreen values are
+        gathered into one extra pixel either side
+        """
+        # As floats, so that integer columns can't overflow
+        min_val = float(values.min() if min_val is None else min_val)
+        max_val = float(values.max() if max_val is None else max_val)
+        scale = num_pixels / (max_val - min_val) if max_val > min_val else 0
+        pixels = numpy.floor((values - min_val) * scale).astype(numpy.int64)
+        return numpy.clip(pixels, -1, num_pixels) + 1
 
     def calc_and_show_stats(self, cli_args, stats_id):
+        # scipy is slow to import and only needed here
+        import scipy.stats
+
         spearmanr, spearmanp = scipy.stats.spearmanr(self.x_data, self.y_data)
         pearsonr, pearsonp = scipy.stats.pearsonr(self.x_data, self.y_data)
 
@@ -119,11 +277,38 @@ class Scatter(cligraph.CLIGraph):
         """
         self.x_data.append(float(fields[self.x_col]))
         self.y_data.append(float(fields[self.y_col]))
-        if self.annotate_col:
+        if self.annotate_col is not None:
             self.annotate_data.append(fields[self.annotate_col])
-        if self.onclick_col:
+        if self.onclick_col is not None:
             self.onclick_data.append(fields[self.onclick_col])
 
+    def get_bulk_columns(self, cli_args):
+        text_columns = [c for c in [self.annotate_col, self.onclick_col] if c is not None]
+        return [self.x_col, self.y_col], text_columns
+
+    def process_input_by_columns(self, axes, cli_args, inp, inp_index, columns):
+        """
+        Keep each chunk of columns; they are joined together once the input ends
+        """
+        self.chunks.append(columns)
+        if cli_args.follow_window is not None:
+            self.chunks = utils.trim_chunks(self.chunks, cli_args.follow_window)
+
+    def gather_chunks(self):
+        """
+        Concatenate the chunks read in bulk into the x, y and annotation data
+        """
+        def gather(column):
+            return utils.concatenate([chunk[column] for chunk in self.chunks])
+
+        self.x_data = gather(self.x_col)
+        self.y_data = gather(self.y_col)
+        if self.annotate_col is not None:
+            self.annotate_data = gather(self.annotate_col)
+        if self.onclick_col is not None:
+            self.onclick_data = gather(self.onclick_col)
+        self.chunks = []
+
     def apply_lables_and_titles(self, fig, axes, cli_args):
         super(Scatter, self).apply_lables_and_titles(fig, axes, cli_args)
 
@@ -132,10 +317,20 @@ class Scatter(cligraph.CLIGraph):
             axes.legend(scatterpoints=1)
 
         if cli_args.onclick_column is not None:
-            fig.canvas.mpl_connect('pick_event', lambda e: self.onclick(e))
+            # The clicked point is marked over a cached copy of the figure
+            self.highlight = axes.plot([], [], 'o', markersize=12, markerfacecolor='none',
+                                       markeredgecolor='k', markeredgewidth=2)[0]
+            self.highlight_blit = interactive.BlitManager(fig.canvas, [self.highlight])
+            fig.canvas.mpl_connect('button_press_event', lambda e: self.onclick(axes, e))
+
+            import matplotlib.widgets
+            self.selector = matplotlib.widgets.RectangleSelector(
+                axes, self.onselect, useblit=True, button=[3], minspanx=5, minspany=5,
+                spancoords='pixels')
 
 
 if __name__ == '__main__':
 
     s = Scatter(grid_default_on=True)
-    s.graphify()
\ No newline at end of file
+    if not s.graphify():
+        sys.exit(1)
@@ -0,0 +1,130 @@
+"""
+Bin edges for --bin-size, checked against the loop they were computed with before being
+vectorised. Run with:
+
+    python2 -m unittest discover tests
+"""
+
+import os
+import random
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import histogram
+
+IRIS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples',
+                    'iris.tsv')
+
+
+def loop_bins(min_val, max_val, bin_size, disable_bin_offset=False, min_x=None, max_x=None):
+    """
+    The edges as Histogram.__get_bins used to accumulate them
+    """
+    bins = []
+    i = numpy.floor(min_val / bin_size) * bin_size
+    if not disable_bin_offset:
+        i -= bin_size / 2.0
+    else:
+        i -= bin_size
+
+    while i <= max_val:
+        bins.append(i)
+        i += bin_size
+    bins.append(i)
+
+    if min_x and min_x > min_val:
+        first_onscreen = max([index for index, b in enumerate(bins) if b <= min_x])
+        if first_onscreen >= 2:
+            bins = [bins[0]] + bins[first_onscreen:]
+    if max_x and max_x < max_val:
+        last_onscreen = min([index for index, b in enumerate(bins) if b > max_x])
+        if last_onscreen < len(bins) - 1:
+            bins = bins[:last_onscreen] + [bins[-1]]
+
+    return bins
+
+
+def get_bins(min_val, max_val, bin_size, disable_bin_offset=False, min_x=None, max_x=None):
+    """
+    The edges Histogram.__get_bins computes now, for a single dataset
+    """
+    graph = histogram.Histogram()
+    argv = ['-z', repr(bin_size)]
+    if disable_bin_offset:
+        argv.append('--disable-bin-offset')
+    if min_x is not None:
+        argv += ['--min-x', repr(min_x)]
+    if max_x is not None:
+        argv += ['--max-x', repr(max_x)]
+
+    graph.store = graph.stream = False
+    graph.data_params = [{'min': min_val, 'max': max_val}]
+    return graph._Histogram__get_bins(graph.get_parser().parse_args(argv), 0)
+
+
+class BinEdgesTest(unittest.TestCase):
+
+    def assert_matches_loop(self, *args, **kwargs):
+        expected = loop_bins(*args, **kwargs)
+        actual = get_bins(*args, **kwargs)
+        self.assertEqual(list(actual), expected, (args, kwargs))
+
+    def test_pinned_edges(self):
+        self.assertEqual(list(get_bins(0.3, 2.2, 0.5)), [-0.25, 0.25, 0.75, 1.25, 1.75, 2.25])
+        self.assertEqual(list(get_bins(0.3, 2.2, 0.5, disable_bin_offset=True)),
+                         [-0.5, 0.0, 0.5, 1.0, 1.5, 2.0, 2.5])
+        self.assertEqual(list(get_bins(1, 10, 2, min_x=5, max_x=7)), [-1.0, 5.0, 7.0, 11.0])
+
+    def test_offsets(self):
+        for disable_bin_offset in [False, True]:
+            self.assert_matches_loop(4.3, 7.9, 0.25, disable_bin_offset=disable_bin_offset)
+            self.assert_matches_loop(-12.7, -3.1, 1.5, disable_bin_offset=disable_bin_offset)
+            self.assert_matches_loop(5, 5, 1, disable_bin_offset=disable_bin_offset)
+
+    def test_offscreen_bins_merged(self):
+        for disable_bin_offset in [False, True]:
+            self.assert_matches_loop(0.1, 99.9, 1, disable_bin_offset, min_x=20, max_x=30)
+            self.assert_matches_loop(0.1, 99.9, 1, disable_bin_offset, min_x=20)
+            self.assert_matches_loop(0.1, 99.9, 1, disable_bin_offset, max_x=30)
+            # Too few bins offscreen to merge
+            self.assert_matches_loop(0.1, 99.9, 1, disable_bin_offset, min_x=0.4, max_x=99.2)
+
+    def test_random_ranges(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            bin_size = rng.choice([0.1, 0.25, 0.3, 1, 2.5, 7])
+            min_val = rng.uniform(-100, 100)
+            max_val = min_val + rng.uniform(0, 50)
+            disable_bin_offset = rng.random() < 0.5
+            min_x = rng.choice([None, rng.uniform(min_val, max_val)])
+            max_x = rng.choice([None, rng.uniform(min_val, max_val)])
+            self.assert_matches_loop(min_val, max_val, bin_size, disable_bin_offset, min_x, max_x)
+
+    def test_max_on_edge(self):
+        # Whether an edge equal to the maximum is kept depends on the rounding of each sum
+        for max_val in [0.3, 1.0, 2.3, 7.9]:
+            for disable_bin_offset in [False, True]:
+                self.assert_matches_loop(0.0, max_val, 0.1, disable_bin_offset)
+                self.assert_matches_loop(0.0, max_val, 0.2, disable_bin_offset)
+
+    def test_values_on_grid(self):
+        # Sepal lengths from examples/iris.tsv all lie on a 0.1 grid, so the smallest
+        # difference in an edge moves values between bars
+        values = numpy.loadtxt(IRIS, usecols=[0])
+        for bin_size in [0.1, 0.2, 0.3]:
+            for disable_bin_offset in [False, True]:
+                args = (values.min(), values.max(), bin_size, disable_bin_offset)
+                self.assert_matches_loop(*args)
+                self.assertEqual(list(numpy.histogram(values, get_bins(*args))[0]),
+                                 list(numpy.histogram(values, loop_bins(*args))[0]))
+
+    def test_empty(self):
+        self.assertEqual(len(get_bins(float('inf'), float('-inf'), 0.5)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+--infer-schema only changes how columns are stored, so every graph must draw the same
+with and without it. Run with:
+
+    python2 -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cligraph
+import utils
+
+# Values either side of float32 rounding of bin edges, integers and repeated categories
+ROWS = [
+    ('0.1', '3', 'a'), ('0.2', '-7', 'b'), ('0.3', '12', 'a'), ('0.3', '5', 'c'),
+    ('0.5', '0', 'b'), ('0.7', '2147483647', 'a'), ('1.23456789', '8', 'c'), ('2.5', '9', 'a'),
+]
+
+
+def get_drawn(figure):
+    """
+    Return everything drawn on a figure's axes as arrays: bars and patches, lines and
+    the offsets of collections, in drawing order
+    """
+    drawn = []
+    for axes in figure.axes:
+        for patch in axes.patches:
+            drawn.append(numpy.asarray(patch.get_path().vertices) if not hasattr(patch, 'get_x')
+                         else numpy.array([patch.get_x(), patch.get_y(), patch.get_width(),
+                                           patch.get_height()]))
+        for line in axes.lines:
+            drawn.append(numpy.asarray(line.get_xydata(), dtype=numpy.float64))
+        for collection in axes.collections:
+            drawn.append(numpy.asarray(collection.get_offsets(), dtype=numpy.float64))
+    return drawn
+
+
+class InferSchemaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input = os.path.join(self.directory, 'input.tsv')
+        with open(self.input, 'w') as input_file:
+            for row in ROWS:
+                input_file.write('\t'.join(row) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def render(self, name, argv):
+        graph = cligraph.load_graph(name)
+        save = os.path.join(self.directory, 'graph')
+        self.assertTrue(graph.graphify([self.input, '-q', '-s', save, '--save-formats', 'png'] +
+                                       argv))
+        drawn = get_drawn(graph.figure)
+        graph.plt.close(graph.figure)
+        return drawn
+
+    def assert_same_drawn(self, name, argv):
+        expected = self.render(name, argv)
+        actual = self.render(name, argv + ['--infer-schema'])
+        self.assertEqual(len(actual), len(expected))
+        for actual_artist, expected_artist in zip(actual, expected):
+            numpy.testing.assert_array_equal(actual_artist, expected_artist)
+        return actual
+
+    def test_histogram(self):
+        drawn = self.assert_same_drawn('histogram', ['-z', '0.1', '--disable-bin-offset'])
+        self.assertEqual([bar[3] for bar in drawn][:8], [0, 1, 3, 0, 0, 1, 0, 1])
+        self.assert_same_drawn('histogram', ['-f', '1,2', '-b', '5'])
+        self.assert_same_drawn('histogram', ['-f', '2', '-b', '5', '-u'])
+        self.assert_same_drawn('histogram', ['-f', '1', '-z', '0.1', '--stream'])
+
+    def test_scatter(self):
+        self.assert_same_drawn('scatter', ['-x', '1', '-y', '2'])
+        self.assert_same_drawn('scatter', ['-x', '2', '-y', '1', '--thin'])
+
+    def test_linegraph(self):
+        self.assert_same_drawn('linegraph', ['-x', '2', '-y', '1'])
+        self.assert_same_drawn('linegraph', ['-x', '1', '-y', '2', '--downsample',
+                                             '--fig-x', '1'])
+
+    def test_barchart(self):
+        for aggregate in ['last', 'sum', 'mean', 'min', 'max', 'std']:
+            self.assert_same_drawn('barchart', ['-d', '3', '-f', '1,2', '--aggregate', aggregate])
+
+
+class ColumnSchemaTest(unittest.TestCase):
+
+    def test_types_widen(self):
+        schema = utils.ColumnSchema()
+        first = utils.read_columns(['1\ta', '2\ta', '3\ta'], '\t', [0], [1], schema)
+        second = utils.read_columns(['0.1\tb', '2\ta'], '\t', [0], [1], schema)
+        self.assertEqual(first[0].dtype, numpy.int32)
+        self.assertEqual(second[0].dtype, numpy.float64)
+        self.assertEqual(list(utils.concatenate([first[0], second[0]])), [1, 2, 3, 0.1, 2])
+
+    def test_no_float32(self):
+        schema = utils.ColumnSchema()
+        values = utils.read_columns(['0.1', '0.3', '1e-40'], None, [0], [], schema)[0]
+        self.assertEqual(values.dtype, numpy.float64)
+        self.assertEqual(list(values), [0.1, 0.3, 1e-40])
+
+    def test_large_integers(self):
+        values = utils.read_columns(['1', '3000000000'], None, [0], [], utils.ColumnSchema())[0]
+        self.assertEqual(values.dtype, numpy.float64)
+        self.assertEqual(list(values), [1, 3000000000])
+
+    def test_categories_shared(self):
+        schema = utils.ColumnSchema()
+        values = utils.read_columns(['a', 'b', 'a', 'a'], None, [], [0], schema)[0]
+        self.assertEqual(list(values), ['a', 'b', 'a', 'a'])
+        self.assertIs(values[0], values[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,47 @@
+import bz2
+import collections
+import contextlib
+import hashlib
 import itertools
+import json
+import mmap
 import os
+import Queue
+import shutil
 import stat
 import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy
+
+# Approximate number of bytes to read at a time when loading columns in bulk
+BULK_CHUNK_SIZE = 1 << 22
+
+# Buffer size for named pipes, which otherwise default to small reads
+PIPE_BUFFER_SIZE = 1 << 20
+
+# Bytes needed to recognise a compressed input
+MAGIC_SIZE = 10
+
+# Compressed bytes read at a time, and the number of decompressed blocks to buffer ahead
+COMPRESSED_BLOCK_SIZE = 1 << 18
+DECOMPRESSED_QUEUE_SIZE = 16
+
+# Text columns with at most this many distinct values per row are stored as categories
+CATEGORY_MAX_RATIO = 0.5
 
 
 class TransparentLineReader:
     """
     Very simple class that facilitates reading from an already opened
     file (e.g. stdin) or a filename or a named pipe
-    without the caller needing to know which it is
+    without the caller needing to know which it is. Regular files
+    (including a redirected stdin) are memory mapped rather than read.
+    gzip, bzip2, xz and zstd inputs are recognised from their first bytes
+    and decompressed in a background thread
 
     TODO: Handle IO errors more gracefully
     """
@@ -16,34 +49,401 @@ class TransparentLineReader:
         self.do_close = True
         self.fd = None
         self.handle = None
+        self.mmap = None
+        self.decompressed = None
+        self.readline = None  # Chosen on first read
+        self.pending = []  # Lines read while looking for a compression format
         self.open = True
+        self.filename = None  # Only set for regular files
 
         if isinstance(filename, file):
             self.handle = filename
             self.do_close = False  # Don't close something if it wasn't opened by us
         elif stat.S_ISFIFO(os.stat(filename).st_mode):
             self.fd = os.open(filename, os.O_RDONLY)
-            self.handle = os.fdopen(self.fd, 'r')
+            self.handle = os.fdopen(self.fd, 'r', PIPE_BUFFER_SIZE)
         else:
             self.handle = open(filename, 'r')
+            self.filename = filename
+
+    def __start(self):
+        """
+        Work out how to read the input from its first bytes. This waits for the first read,
+        so nothing is consumed from inputs that are handed to other processes instead
+        """
+        regular = stat.S_ISREG(os.fstat(self.handle.fileno()).st_mode)
+        position = self.handle.tell() if regular else None
+        magic = self.handle.read(MAGIC_SIZE)
+
+        decompressor = get_decompressor(magic)
+        if decompressor is not None:
+            self.decompressed = DecompressingReader(self.handle, decompressor, magic)
+            self.readline = self.decompressed.readline
+        elif regular:
+            self.handle.seek(position)
+            self.__map()
+        else:
+            # The bytes can't be put back, so finish their line and keep them for later
+            if magic and not magic.endswith('\n'):
+                magic += self.handle.readline()
+            pieces = magic.split('\n')
+            self.pending = [piece + '\n' for piece in pieces[:-1]] + filter(None, pieces[-1:])
+            self.readline = self.handle.readline
+
+    def __map(self):
+        """
+        Memory map the rest of the input if it is a regular file. Empty files can't be mapped
+        """
+        self.readline = self.handle.readline
+        if os.fstat(self.handle.fileno()).st_size == 0:
+            return
+
+        position = self.handle.tell()
+        self.mmap = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mmap.seek(position)
+        self.readline = self.mmap.readline
 
     def __iter__(self):
         return self
 
     def next(self):
-        line = self.handle.readline()
+        if self.readline is None:
+            self.__start()
+        if self.pending:
+            return self.pending.pop(0)
+
+        line = self.readline()
         if line == "":
             self.close()
             raise StopIteration
         else:
             return line
 
+    def read_lines(self, size_hint=BULK_CHUNK_SIZE):
+        """
+        Read a chunk of whole lines totalling approximately size_hint bytes.
+        An empty list is returned (and the input closed) once exhausted.
+        Lines may or may not include their trailing newline
+        """
+        if not self.open:
+            return []
+        if self.readline is None:
+            self.__start()
+
+        if self.mmap is not None:
+            lines = self.__read_mapped_lines(size_hint)
+        elif self.decompressed is not None:
+            lines = self.decompressed.read_lines(size_hint)
+        else:
+            lines = self.handle.readlines(size_hint)
+        if self.pending:
+            lines, self.pending = self.pending + lines, []
+        if not lines:
+            self.close()
+        return lines
+
+    def __read_mapped_lines(self, size_hint):
+        """
+        Slice the mapping at the first newline after size_hint bytes, and split the slice
+        into lines in one go
+        """
+        start, size = self.mmap.tell(), self.mmap.size()
+        if start >= size:
+            return []
+
+        end = self.mmap.find('\n', min(start + size_hint, size) - 1)
+        end = size if end == -1 else end + 1
+        self.mmap.seek(end)
+
+        lines = self.mmap[start:end].split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        return lines
+
     def close(self):
+        if self.open and self.mmap is not None:
+            self.mmap.close()
+        if self.open and self.decompressed is not None:
+            self.decompressed.close()
         if self.do_close and self.open:
             self.handle.close()
         self.open = False
 
 
+def get_decompressor(magic):
+    """
+    Return a function creating a decompressor for input starting with the bytes magic,
+    or None if it isn't compressed in a format we know. xz and zstd need optional modules
+    """
+    if magic.startswith('\x1f\x8b'):
+        return lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+    # A block header follows, or the end of stream marker if empty
+    if magic[:3] == 'BZh' and magic[4:10] in ['1AY&SY', '\x17rE8P\x90']:
+        return bz2.BZ2Decompressor
+    if magic.startswith('\xfd7zXZ\x00'):
+        try:
+            from backports import lzma
+        except ImportError:
+            raise IOError('Reading xz input requires the backports.lzma module')
+        return lzma.LZMADecompressor
+    if magic.startswith('\x28\xb5\x2f\xfd'):
+        try:
+            import zstandard
+        except ImportError:
+            raise IOError('Reading zstd input requires the zstandard module')
+        return lambda: zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+class DecompressingReader:
+    """
+    Read lines from a compressed file. A background thread reads and decompresses
+    blocks (the decompressors release the GIL), overlapped with parsing, and passes
+    them over through a bounded queue. Concatenated streams, as from cat a.gz b.gz,
+    are read one after another
+    """
+    def __init__(self, handle, new_decompressor, initial=''):
+        self.queue = Queue.Queue(DECOMPRESSED_QUEUE_SIZE)
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+        self.closed = False
+
+        thread = threading.Thread(target=self.__decompress,
+                                  args=(handle, new_decompressor, initial))
+        thread.daemon = True
+        thread.start()
+
+    def __decompress(self, handle, new_decompressor, data):
+        """
+        Thread body. Errors are passed through the queue to be raised by the reader
+        """
+        try:
+            decompressor = new_decompressor()
+            data = data or handle.read(COMPRESSED_BLOCK_SIZE)
+            while data and not self.closed:
+                try:
+                    block = decompressor.decompress(data)
+                except EOFError:
+                    # The last stream ended exactly at the end of a read
+                    decompressor = new_decompressor()
+                    continue
+
+                data = getattr(decompressor, 'unused_data', '')
+                if data:
+                    decompressor = new_decompressor()
+                else:
+                    data = handle.read(COMPRESSED_BLOCK_SIZE)
+                if block:
+                    self.__put(block)
+
+            if hasattr(decompressor, 'flush'):
+                self.__put(decompressor.flush())
+            self.__put(None)
+        except Exception as e:
+            self.__put(e)
+
+    def __put(self, item):
+        # Give up if the reader is closed early, rather than blocking on a full queue forever
+        while not self.closed:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def __get(self):
+        """
+        Return the next decompressed block, or '' at the end of the input
+        """
+        if self.eof:
+            return ''
+
+        item = self.queue.get()
+        if item is None or isinstance(item, Exception):
+            self.eof = True
+        if isinstance(item, Exception):
+            raise item
+        return item or ''
+
+    def readline(self):
+        end = self.buffer.find('\n', self.position)
+        while end == -1 and not self.eof:
+            self.buffer = self.buffer[self.position:] + self.__get()
+            self.position = 0
+            end = self.buffer.find('\n')
+
+        end = len(self.buffer) if end == -1 else end + 1
+        line = self.buffer[self.position:end]
+        self.position = end
+        return line
+
+    def read_lines(self, size_hint):
+        """
+        Return whole lines, without newlines, from at least size_hint decompressed bytes
+        """
+        pieces = [self.buffer[self.position:]]
+        size = len(pieces[0])
+        while not self.eof and (size < size_hint or '\n' not in pieces[-1]):
+            pieces.append(self.__get())
+            size += len(pieces[-1])
+
+        text = ''.join(pieces)
+        end = len(text) if self.eof else text.rfind('\n') + 1
+        self.buffer, self.position = text, end
+
+        lines = text[:end].split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        return lines
+
+    def close(self):
+        self.closed = True
+
+
+class LineFollower:
+    """
+    Read lines from a TransparentLineReader in a background thread, so that those read so
+    far can be collected while the input is still open (e.g. a pipe being written to)
+    """
+    def __init__(self, inp, batch_rows):
+        self.inp = inp
+        self.batch_rows = batch_rows
+        self.lines = []
+        self.lock = threading.Lock()
+        self.ready = threading.Event()  # Set once batch_rows lines are waiting, or at the end
+        self.finished = False
+        self.error = None
+
+        thread = threading.Thread(target=self.__read)
+        thread.daemon = True
+        thread.start()
+
+    def __read(self):
+        try:
+            for line in self.inp:
+                with self.lock:
+                    self.lines.append(line)
+                    if len(self.lines) >= self.batch_rows:
+                        self.ready.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.lock:
+                self.finished = True
+                self.ready.set()
+
+    def get_lines(self, timeout):
+        """
+        Wait up to timeout seconds for batch_rows lines, then return the lines read since
+        the last call. Returns None once the input has ended and every line has been returned
+        """
+        self.ready.wait(timeout)
+        with self.lock:
+            lines, self.lines = self.lines, []
+            finished = self.finished
+            if not finished:
+                self.ready.clear()
+
+        if self.error is not None:
+            raise self.error
+        if finished and not lines:
+            return None
+        return lines
+
+
+class ColumnCache:
+    """
+    Columns parsed from a regular file, saved as .npy files so that later runs can
+    memory map them instead of parsing the text again. Entries are keyed on the file's
+    path, modification time and size, along with the separator, columns read and how
+    """
+    def __init__(self, directory, filename, separator, numeric_columns, text_columns=(),
+                 header=False, infer_schema=False):
+        self.directory = directory
+        self.numeric_columns = numeric_columns
+        self.text_columns = text_columns
+
+        file_stat = os.stat(filename)
+        key = repr((os.path.realpath(filename), file_stat.st_mtime, file_stat.st_size,
+                    separator, list(numeric_columns), list(text_columns)))
+        # Kept out of the key when unset, so existing entries remain valid
+        if header or infer_schema:
+            key += repr((header, infer_schema))
+        self.path = os.path.join(directory, hashlib.sha1(key).hexdigest())
+
+    def load(self):
+        """
+        Return a dict of column -> memory mapped array, or None if nothing is cached
+        """
+        if not os.path.isdir(self.path):
+            return None
+
+        return dict((column, numpy.load(self.__column_path(self.path, column), mmap_mode='r'))
+                    for column in set(self.numeric_columns) | set(self.text_columns))
+
+    def save(self, columns):
+        """
+        Save columns as returned by read_columns(). Text is stored as fixed width strings,
+        which unlike Python objects can be memory mapped
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        # Write to a temporary directory first so partial entries are never loaded
+        tmp_path = tempfile.mkdtemp(dir=self.directory)
+        for column, values in columns.iteritems():
+            if values.dtype == object:
+                values = values.astype(str)
+            numpy.save(self.__column_path(tmp_path, column), values)
+
+        try:
+            os.rename(tmp_path, self.path)
+        except OSError:
+            # Another run saved the same entry first
+            shutil.rmtree(tmp_path)
+
+    def __column_path(self, path, column):
+        return os.path.join(path, '%d.npy' % column)
+
+
+class Profiler:
+    """
+    Wall-clock timings of named stages, accumulated if a stage is repeated, along with
+    the number of rows read from each input. Stages are always timed as it is cheap;
+    enabled signals that finer grained (e.g. per row) timing is wanted
+    """
+    def __init__(self):
+        self.enabled = False
+        self.stages = collections.OrderedDict()
+        self.inputs = []
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.stages[stage] = self.stages.get(stage, 0) + time.time() - start
+
+    def add_input(self, index, rows, seconds):
+        self.inputs.append({'index': index, 'rows': rows, 'seconds': seconds,
+                            'rows_per_second': rows / seconds if seconds else None})
+
+    def report(self, stream):
+        print >> stream, '%-32s %10s' % ('Stage', 'Seconds')
+        for stage, seconds in self.stages.iteritems():
+            print >> stream, '%-32s %10.4f' % (stage, seconds)
+        for inp in self.inputs:
+            print >> stream, 'Input %d: %d rows in %.4fs (%s rows/s)' % (
+                inp['index'], inp['rows'], inp['seconds'],
+                '%.0f' % inp['rows_per_second'] if inp['rows_per_second'] else '-')
+
+    def save(self, filename):
+        with open(filename, 'w') as output:
+            json.dump({'stages': self.stages, 'inputs': self.inputs}, output, indent=2)
+
+
 def map_csv_to_cycle(arg, f, sep=','):
     """
     Map the supplied argument to a cycle, by splitting by sep and
@@ -58,31 +458,213 @@ def map_csv_to_cycle(arg, f, sep=','):
     return itertools.cycle(values)
 
 
-def get_columns_from_string(column_string):
+def get_columns_from_string(column_string, names=None):
     """
     Takes a unix cut-like format for columns, returning a list
-    of integers suitable for indexing into a list of fields (i.e. 0-based)
+    of integers suitable for indexing into a list of fields (i.e. 0-based).
+    Given the column names from a header, columns may also be named
     """
     columns = []
     if column_string is None:
         return columns
 
-    list_pieces = column_string.strip().split(',')
+    list_pieces = str(column_string).strip().split(',')
     list_pieces = map(lambda x: x.strip(), list_pieces)
 
     try:
         for list_piece in list_pieces:
+            # Names may themselves contain dashes
+            if names and list_piece in names:
+                columns.append(get_column_number(list_piece, names))
+                continue
+
             range_pieces = list_piece.split('-')
             if len(range_pieces) > 2:
                 print >>sys.stderr, "Malformated column range"
                 sys.exit()
 
             if len(range_pieces) == 1:
-                columns.append(int(range_pieces[0]))
+                columns.append(get_column_number(range_pieces[0], names))
             else:
-                columns.extend(range(int(range_pieces[0]), int(range_pieces[1]) + 1))
+                columns.extend(range(get_column_number(range_pieces[0], names),
+                                     get_column_number(range_pieces[1], names) + 1))
     except ValueError as e:
         print >> sys.stderr, e
         return []
 
-    return map(lambda c: c-1, columns)
\ No newline at end of file
+    return map(lambda c: c-1, columns)
+
+
+def get_column_number(column, names=None):
+    """
+    Return the 1-based number of a column given by number or, with header names, by name
+    """
+    column = column.strip()
+    if names and column in names:
+        return names.index(column) + 1
+    if names is not None and not column.isdigit():
+        raise ValueError('No column named %s' % column)
+    return int(column)
+
+
+def get_column_from_string(column_string, names=None):
+    """
+    As get_columns_from_string(), for options taking a single column. Returns a 0-based
+    column, or None (with an error printed) if column_string isn't a single column
+    """
+    columns = get_columns_from_string(column_string, names)
+    if len(columns) > 1:
+        print >> sys.stderr, 'Expected a single column: %s' % column_string
+    if len(columns) != 1:
+        return None
+    return columns[0]
+
+
+def read_columns(lines, separator, numeric_columns, text_columns=(), schema=None):
+    """
+    Split a chunk of lines into fields and gather only the requested (0-based)
+    columns. Numeric columns are converted to float arrays by numpy in one go
+    rather than value by value. Given a ColumnSchema, columns are stored with the
+    types it infers instead. Returns a dict of column -> numpy array
+    """
+    split = get_field_splitter(separator, list(numeric_columns) + list(text_columns))
+    rows = [split(line) for line in lines]
+
+    columns = {}
+    for column in numeric_columns:
+        values = [row[column] for row in rows]
+        if schema is None:
+            columns[column] = numpy.array(values, dtype=numpy.float64)
+        else:
+            columns[column] = schema.convert_numeric(column, values)
+    for column in text_columns:
+        values = [row[column] for row in rows]
+        if schema is not None:
+            values = schema.convert_text(column, values)
+        columns[column] = numpy.array(values, dtype=object)
+
+    return columns
+
+
+class ColumnSchema:
+    """
+    The narrowest type holding every value of each column read from an input so far.
+    Types are inferred from the first chunk and widened when a later chunk doesn't fit
+    (e.g. int32 to float64), so earlier chunks may be narrower than later ones; joining
+    them with numpy.concatenate widens them all. Numeric columns are int32 or float64;
+    float32 isn't used, as rounding to it would move values across bin edges and change
+    what is drawn. Text columns with many repeats are categories, keeping each distinct
+    value once for every row to refer to, or else objects
+    """
+    def __init__(self):
+        self.dtypes = {}
+        self.categories = {}  # Column -> dict of each distinct value to itself
+        self.rows = collections.Counter()
+
+    def convert_numeric(self, column, text):
+        values = numpy.array(text, dtype=numpy.float64)
+        dtype = self.dtypes.get(column)
+        if dtype != numpy.float64:
+            fitted = get_numeric_dtype(values)
+            dtype = fitted if dtype is None else numpy.promote_types(dtype, fitted)
+            self.dtypes[column] = dtype
+        return values.astype(dtype, copy=False)
+
+    def convert_text(self, column, text):
+        self.rows[column] += len(text)
+        if column not in self.dtypes:
+            self.dtypes[column] = 'category'
+            self.categories[column] = {}
+        if self.dtypes[column] != 'category':
+            return text
+
+        categories = self.categories[column]
+        text = map(categories.setdefault, text, text)
+        if len(categories) > CATEGORY_MAX_RATIO * self.rows[column]:
+            self.dtypes[column] = object
+            del self.categories[column]
+        return text
+
+
+def get_numeric_dtype(values):
+    """
+    Return int32 if it holds every value exactly, or else float64
+    """
+    if not len(values):
+        return numpy.dtype(numpy.int32)
+
+    int32 = numpy.iinfo(numpy.int32)
+    if (numpy.all(values == numpy.floor(values)) and
+            values.min() >= int32.min and values.max() <= int32.max):
+        return numpy.dtype(numpy.int32)
+    return numpy.dtype(numpy.float64)
+
+
+def get_field_splitter(separator, columns=None):
+    """
+    Return a function splitting a line into fields as line.strip().split(separator) does,
+    but stopping once the highest of the given (0-based) columns is reached, so that the
+    rest of a wide line is left alone. With no columns given, every field is split
+    """
+    if columns is None:
+        return lambda line: line.strip().split(separator)
+
+    max_split = max(columns) + 1 if columns else 0
+    if max_split == 1 and separator is not None:
+        # Only the first field is needed, which partition finds without building a list
+        return lambda line: (line.strip().partition(separator)[0],)
+    return lambda line: line.strip().split(separator, max_split)
+
+
+def concatenate_columns(chunks, numeric_columns, text_columns=()):
+    """
+    Join chunks returned by read_columns() into a single dict of column -> numpy array
+    """
+    if not chunks:
+        return read_columns([], None, numeric_columns, text_columns)
+
+    return dict((column, concatenate([chunk[column] for chunk in chunks]))
+                for column in chunks[0])
+
+
+def count_rows(columns):
+    """
+    Return the number of rows in a dict of columns returned by read_columns()
+    """
+    return len(next(columns.itervalues())) if columns else 0
+
+
+def trim_chunks(chunks, rows):
+    """
+    Drop the oldest rows from a list of chunks returned by read_columns() so that at most
+    rows remain. Returns the new list
+    """
+    return trim_arrays(chunks, rows, lambda chunk: len(chunk.itervalues().next()),
+                       lambda chunk, start: dict((column, values[start:])
+                                                 for column, values in chunk.iteritems()))
+
+
+def trim_arrays(arrays, rows, length=len, slice_from=lambda array, start: array[start:]):
+    """
+    Drop the oldest values from a list of arrays so that at most rows remain. Returns the
+    new list
+    """
+    excess = sum(length(array) for array in arrays) - rows
+    arrays = list(arrays)
+    while excess > 0 and arrays:
+        if length(arrays[0]) <= excess:
+            excess -= length(arrays.pop(0))
+        else:
+            arrays[0] = slice_from(arrays[0], excess)
+            excess = 0
+    return arrays
+
+
+def concatenate(arrays):
+    """
+    numpy.concatenate, without copying when there is a single array (which may be memory
+    mapped from a cache)
+    """
+    if len(arrays) == 1:
+        return arrays[0]
+    return numpy.concatenate(arrays)